@@ -38,6 +38,8 @@ def login_required(func):
         return func(message, *args, **kwargs)
     return wrapper
 
+# The bot has its own tables and connections. Nothing it writes goes through the website's Database class,
+# so pointing it at the website's tables would leave the website's query cache stale for up to DB_CACHE_TTL.
 def get_db_connection():
     try:
         connection = psycopg2.connect(DB_URI)
@@ -1,19 +1,46 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, make_response, Response
 import os
-from datetime import datetime, timedelta
+import io
+import csv
+import json
+import queue
+import hashlib
+from functools import wraps
+from datetime import datetime
 from dotenv import load_dotenv
-from database import Database
+from database import Database, WEIGHT_CLASSES, FIGHTER_STATUSES, AUTOCOMPLETE_SOURCES, VERSIONED_TABLES
+from json_provider import FastJSONProvider
 import traceback
 
 load_dotenv()
 
 app = Flask(__name__)
+# Rows go straight to orjson, which writes dates, intervals and numerics itself
+app.json = FastJSONProvider(app)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key')
 db = Database()
 
 ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'admin')
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin')
 
+MAX_PAGE_SIZE = 500
+MAX_BULK_ROWS = 50000
+STREAM_CHUNK_SIZE = 64 * 1024
+MAX_AUTOCOMPLETE_RESULTS = 50
+
+# Picker lookups repeat the same few prefixes while someone types, so browsers may reuse results briefly
+AUTOCOMPLETE_TTL = int(os.environ.get('AUTOCOMPLETE_TTL', 10))
+
+# Idle /api/events streams send a comment this often, so proxies keep them open and closed tabs are noticed
+EVENTS_HEARTBEAT = int(os.environ.get('EVENTS_HEARTBEAT', 15))
+# Every open /api/events stream holds a server thread for as long as the tab stays open, so the server has to
+# run with threads (or an async worker class) to spare: keep this below the number of threads it can run
+EVENTS_MAX_SUBSCRIBERS = int(os.environ.get('EVENTS_MAX_SUBSCRIBERS', 50))
+EVENTS_RETRY_AFTER = int(os.environ.get('EVENTS_RETRY_AFTER', 60))
+
+# Lists and details change whenever someone edits them, so clients store them but revalidate every use
+REVALIDATE = 'private, no-cache'
+
 def require_login(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
@@ -25,48 +52,275 @@ def require_login(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
-def convert_to_dict(obj):
-    """Convert RealDictRow or any database result to a JSON-serializable dictionary"""
-    if obj is None:
-        return None
+def conditional(*tables, cache_control=REVALIDATE):
+    """Tag GET responses with an ETag from the tables' change versions, answering a matching If-None-Match with 304"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # Read before the view's queries: a write committed in between makes the ETag older than the body,
+            # which only costs the client one more full download. The view's cached reads are pinned to these
+            # versions too, so the body is never older than the ETag.
+            versions = db.get_table_versions(tables)
+            if versions is None:
+                return f(*args, **kwargs)
+            db.use_table_versions(tables, versions)
+            
+            key = f"{request.full_path}|{request.headers.get('Accept', '')}|{versions}"
+            etag = hashlib.sha1(key.encode()).hexdigest()
+            
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = cache_control
+            response.vary.add('Accept')
+            return response
+        return decorated_function
+    return decorator
+
+@app.before_request
+def begin_unit_of_work():
+    # The connection itself is only checked out of the pool on first use
+    db.begin_unit_of_work()
+
+@app.after_request
+def commit_unit_of_work(response):
+    try:
+        db.end_unit_of_work(commit=response.status_code < 400)
+    except Exception as e:
+        print(f"Error committing request: {e}")
+        if request.path.startswith('/api/'):
+            return make_response(jsonify({'error': 'Failed to commit changes'}), 500)
+        return make_response(render_template('500.html'), 500)
+    return response
+
+@app.teardown_request
+def close_unit_of_work(error):
+    # Only does anything when after_request was skipped because of an unhandled exception
+    db.end_unit_of_work(commit=False)
+
+def page_args(default_limit=100):
+    """Read keyset pagination arguments (limit, cursor) from the query string"""
+    limit = request.args.get('limit', default_limit, type=int)
+    return max(1, min(limit, MAX_PAGE_SIZE)), request.args.get('cursor') or None
+
+def page_response(rows, total=None):
+    """Return a page of rows as a JSON list, with the next page cursor in the X-Next-Cursor and Link headers"""
+    response = jsonify(rows or [])
     
-    if isinstance(obj, dict):
-        result = {}
-        for key, value in obj.items():
-            result[key] = convert_value(value)
-        return result
-    elif hasattr(obj, '_asdict'):  # For RealDictRow or namedtuple-like objects
-        result = {}
-        for key, value in obj._asdict().items():
-            result[key] = convert_value(value)
-        return result
-    elif isinstance(obj, list):
-        return [convert_to_dict(item) for item in obj]
-    else:
-        return obj
+    if total is not None:
+        response.headers['X-Total-Count'] = str(total)
+    
+    next_cursor = getattr(rows, 'next_cursor', None)
+    if next_cursor:
+        next_args = {**request.view_args, **request.args.to_dict(), 'cursor': next_cursor}
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{url_for(request.endpoint, **next_args)}>; rel="next"'
+    return response
+
+def fields_arg():
+    """Read the ?fields= list of columns to return; None returns every column"""
+    fields = request.args.get('fields')
+    if fields is None:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
 
-def convert_value(value):
-    """Convert individual values to JSON-serializable types"""
-    if value is None:
+def int_arg(name):
+    """Read an optional integer query argument, rejecting values that aren't integers"""
+    value = request.args.get(name)
+    if value is None or value == '':
         return None
-    elif isinstance(value, datetime):  # This checks if it's a datetime object
-        return value.isoformat()
-    elif isinstance(value, timedelta):
-        total_seconds = int(value.total_seconds())
-        hours = total_seconds // 3600
-        minutes = (total_seconds % 3600) // 60
-        seconds = total_seconds % 60
-        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-    elif hasattr(value, 'to_integral_value'):  # For Decimal
-        return int(value.to_integral_value())
-    elif isinstance(value, (int, float, str, bool)):
-        return value
-    elif isinstance(value, (list, tuple)):
-        return [convert_value(item) for item in value]
-    elif isinstance(value, dict):
-        return convert_to_dict(value)
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+
+def fighter_filters():
+    """Read the fighter list filters from the query string"""
+    weight_class = request.args.get('weight_class') or None
+    if weight_class is not None and weight_class not in WEIGHT_CLASSES:
+        raise ValueError(f'Invalid weight_class: {weight_class}')
+    status = request.args.get('status') or None
+    if status is not None and status not in FIGHTER_STATUSES:
+        raise ValueError(f'Invalid status: {status}')
+    
+    return {
+        'weight_class': weight_class,
+        'status': status,
+        'gym_id': int_arg('gym_id'),
+        'nationality': request.args.get('nationality') or None,
+        'min_age': int_arg('min_age'),
+        'max_age': int_arg('max_age'),
+    }
+
+def trainer_filters():
+    """Read the trainer list filters from the query string"""
+    return {
+        'specialty': request.args.get('specialty') or None,
+        'gym_id': int_arg('gym_id'),
+    }
+
+def stream_format():
+    """Return 'ndjson' or 'csv' when the client asked for a streamed list (?format= or Accept), None for JSON pages"""
+    file_format = request.args.get('format')
+    if file_format is None:
+        accepted = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson', 'text/csv'])
+        file_format = {'application/x-ndjson': 'ndjson', 'text/csv': 'csv'}.get(accepted, 'json')
+    
+    if file_format not in ('json', 'ndjson', 'csv'):
+        raise ValueError(f'Invalid format: {file_format}')
+    if file_format != 'json' and request.args.get('search'):
+        raise ValueError('Streamed responses are only available for unfiltered lists')
+    return None if file_format == 'json' else file_format
+
+def stream_response(rows, file_format, name, total=None):
+    """Write rows out as NDJSON lines or CSV while they are fetched, instead of building the whole list first"""
+    def generate():
+        buffer = io.StringIO()
+        writer = None
+        for row in rows:
+            if file_format == 'ndjson':
+                buffer.write(app.json.dumps(row) + '\n')
+            else:
+                if writer is None:
+                    writer = csv.DictWriter(buffer, fieldnames=list(row.keys()))
+                    writer.writeheader()
+                # Nested member lists are written as JSON text
+                writer.writerow({key: app.json.dumps(value) if isinstance(value, (list, dict)) else value
+                                 for key, value in row.items()})
+            # Rows are small, so they go out in chunks rather than one write each
+            if buffer.tell() >= STREAM_CHUNK_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    if file_format == 'csv':
+        response = Response(generate(), mimetype='text/csv')
+        response.headers['Content-Disposition'] = f'attachment; filename={name}.csv'
     else:
-        return str(value)
+        response = Response(generate(), mimetype='application/x-ndjson')
+    
+    if total is not None:
+        response.headers['X-Total-Count'] = str(total)
+    return response
+
+def bulk_create(parse_row, create_rows, references=(), check_rows=None):
+    """Validate a JSON array of new rows as a whole, then create all of them or none, reporting errors per row"""
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Expected a non-empty JSON array'}), 400
+    if len(items) > MAX_BULK_ROWS:
+        return jsonify({'error': f'At most {MAX_BULK_ROWS} rows can be created per request'}), 413
+    
+    rows = {}
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError('Expected an object')
+            rows[index] = parse_row(item)
+        except (ValueError, TypeError) as e:
+            errors.append({'index': index, 'error': str(e)})
+    
+    # References are checked with one query per referenced table, not one per row
+    for positions, table, column, label in references:
+        ids = {rows[index][position] for index in rows for position in positions} - {None}
+        existing = db.get_existing_ids(table, column, ids) if ids else set()
+        if existing is None:
+            raise RuntimeError(f'Failed to check {table}')
+        for index in rows:
+            for position in positions:
+                if rows[index][position] is not None and rows[index][position] not in existing:
+                    errors.append({'index': index, 'error': f'{label} {rows[index][position]} not found'})
+    
+    if check_rows:
+        errors.extend(check_rows(rows))
+    
+    if errors:
+        return jsonify({'errors': sorted(errors, key=lambda error: error['index']), 'success': False}), 400
+    
+    ids = create_rows(list(rows.values()))
+    if ids is None:
+        return jsonify({'error': 'Failed to create rows', 'success': False}), 500
+    
+    return jsonify({'ids': ids, 'created': len(ids), 'success': True})
+
+def required_fields(item, fields):
+    """Raise ValueError for the first missing or empty field, like the single create endpoints"""
+    for field in fields:
+        if field not in item or not item[field]:
+            raise ValueError(f'{field} is required')
+
+def optional_id(value):
+    """Parse an optional id where '' and null both mean none"""
+    return None if value == '' or value is None else int(value)
+
+def parse_gym_row(item):
+    required_fields(item, ['name', 'location', 'owner'])
+    reputation_score = int(item.get('reputation_score', 75))
+    if not 0 <= reputation_score <= 100:
+        raise ValueError('reputation_score must be between 0 and 100')
+    return (item['name'], item['location'], item['owner'], reputation_score)
+
+def check_gym_rows(rows):
+    """Report gyms whose (name, location) repeats within the batch or already exists"""
+    errors = []
+    seen = set()
+    for index, row in rows.items():
+        if row[:2] in seen:
+            errors.append({'index': index, 'error': f'Gym {row[0]} in {row[1]} appears more than once'})
+        seen.add(row[:2])
+    
+    existing = db.get_existing_gym_keys(seen) if seen else set()
+    if existing is None:
+        raise RuntimeError('Failed to check gyms')
+    for index, row in rows.items():
+        if row[:2] in existing:
+            errors.append({'index': index, 'error': f'Gym {row[0]} in {row[1]} already exists'})
+    return errors
+
+def parse_fighter_row(item):
+    required_fields(item, ['name', 'weight_class', 'height', 'age', 'status'])
+    if item['weight_class'] not in WEIGHT_CLASSES:
+        raise ValueError(f"Invalid weight_class: {item['weight_class']}")
+    if item['status'] not in FIGHTER_STATUSES:
+        raise ValueError(f"Invalid status: {item['status']}")
+    
+    height = float(item['height'])
+    age = int(item['age'])
+    if height <= 0 or age <= 0:
+        raise ValueError('height and age must be positive')
+    
+    return (item['name'], item.get('nickname'), item['weight_class'], height, age,
+            item.get('nationality'), item['status'], optional_id(item.get('gym_id')))
+
+def parse_trainer_row(item):
+    required_fields(item, ['name', 'specialty'])
+    return (item['name'], item['specialty'], optional_id(item.get('gym_id')))
+
+def parse_match_row(item):
+    required_fields(item, ['start_date', 'end_date', 'location', 'fighter1_id', 'fighter2_id'])
+    start_date = datetime.fromisoformat(item['start_date'])
+    end_date = datetime.fromisoformat(item['end_date'])
+    fighter1_id = int(item['fighter1_id'])
+    fighter2_id = int(item['fighter2_id'])
+    
+    # Same default as the single create endpoint: no winner means a draw
+    winner_id = optional_id(item.get('winner_id', 0))
+    return (start_date, end_date, item['location'], fighter1_id, fighter2_id, winner_id)
+
+def check_match_rows(rows):
+    """Report matches create_match would reject, checked by the database in one query"""
+    positions = list(rows)
+    invalid = db.find_match_errors([rows[index] for index in positions])
+    if invalid is None:
+        raise RuntimeError('Failed to check matches')
+    return [{'index': positions[position], 'error': error} for position, error in invalid.items()]
 
 @app.route('/')
 def index():
@@ -119,63 +373,59 @@ def fighters():
         flash('Please login to access fighter management', 'warning')
         return redirect(url_for('login'))
     
-    page = request.args.get('page', 1, type=int)
+    per_page, cursor = page_args()
     search_term = request.args.get('search', '')
     
     # Get fighters
     if search_term:
-        fighters_list = db.search_fighters(search_term, limit=100)
+        fighters_list = db.search_fighters(search_term, limit=per_page, cursor=cursor)
     else:
-        fighters_list = db.get_all_fighters(limit=100)
-    
-    # Get gyms for the create form
-    gyms = db.get_all_gyms()
+        fighters_list = db.get_all_fighters(limit=per_page, cursor=cursor)
     
+    # Pickers load gyms from /api/autocomplete as they are opened
     return render_template('fighters.html', 
                          fighters=fighters_list,
-                         gyms=gyms,
-                         page=page,
+                         cursor=cursor,
+                         next_cursor=getattr(fighters_list, 'next_cursor', None),
                          search_term=search_term)
 
 @app.route('/api/fighters', methods=['GET'])
+@conditional('fighters', 'fighter_records', 'gyms')
 def get_fighters():
-    """Get all fighters with gym info"""
+    """Get all fighters with gym info, optionally filtered by weight_class, status, gym_id, nationality and age"""
     try:
         search_term = request.args.get('search', '')
         
-        if search_term:
-            fighters = db.search_fighters(search_term, limit=100)
-        else:
-            fighters = db.get_all_fighters(limit=100)
+        fields = fields_arg()
+        filters = fighter_filters()
+        # Filtered totals would need a COUNT(*), so only the unfiltered list reports one
+        filtered = any(value is not None for value in filters.values())
         
-        if not fighters:
-            return jsonify([])
+        file_format = stream_format()
+        if file_format:
+            return stream_response(db.stream_fighters(include_details=True, fields=fields, filters=filters),
+                                   file_format, 'fighters', None if filtered else db.get_table_count('fighters'))
         
-        # Enhance fighter data with gym info and records
-        enhanced_fighters = []
-        for fighter in fighters:
-            fighter_dict = dict(fighter)
-            
-            # Get fighter record
-            record = db.get_fighter_with_record(fighter_dict['fighter_id'])
-            if record:
-                fighter_dict['wins'] = record.get('wins', 0)
-                fighter_dict['losses'] = record.get('losses', 0)
-                fighter_dict['draws'] = record.get('draws', 0)
-            
-            # Get gym name if available
-            if fighter_dict.get('gym_id'):
-                gym = db.get_gym('gym_id', fighter_dict['gym_id'])
-                if gym:
-                    fighter_dict['gym_name'] = gym['name']
-            
-            enhanced_fighters.append(fighter_dict)
+        limit, cursor = page_args()
+        
+        # Records and gym names are joined in by the same query
+        if search_term:
+            fighters = db.search_fighters(search_term, limit=limit, include_details=True, cursor=cursor,
+                                          fields=fields, filters=filters)
+        else:
+            fighters = db.get_all_fighters(limit=limit, include_details=True, cursor=cursor, fields=fields,
+                                           filters=filters)
         
-        return jsonify(enhanced_fighters)
+        # Unfiltered totals come from the trigger-maintained counters, not a COUNT(*) scan
+        total = None if search_term or filtered else db.get_table_count('fighters')
+        return page_response(fighters, total)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/fighters/<int:fighter_id>', methods=['GET'])
+@conditional('fighters', 'fighter_records', 'gyms')
 def get_fighter(fighter_id):
     """Get detailed fighter information"""
     try:
@@ -243,6 +493,16 @@ def create_fighter():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/fighters/bulk', methods=['POST'])
+@require_login
+def create_fighters_bulk():
+    """Create fighters from a JSON array; nothing is created unless every row is valid"""
+    try:
+        return bulk_create(parse_fighter_row, db.create_fighters_bulk,
+                           references=[((7,), 'gyms', 'gym_id', 'Gym')])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/fighters/<int:fighter_id>', methods=['PUT'])
 @require_login
 def update_fighter(fighter_id):
@@ -349,30 +609,35 @@ def create_trainer():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/trainers/bulk', methods=['POST'])
+@require_login
+def create_trainers_bulk():
+    """Create trainers from a JSON array; nothing is created unless every row is valid"""
+    try:
+        return bulk_create(parse_trainer_row, db.create_trainers_bulk,
+                           references=[((2,), 'gyms', 'gym_id', 'Gym')])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/trainers/<int:trainer_id>', methods=['GET'])
+@conditional('trainers', 'gyms', 'fighter_trainer', 'fighters')
 def get_trainer_details(trainer_id):
     """Get detailed trainer information"""
     try:
-        trainer = db.get_trainer('trainer_id', trainer_id)
+        # The trainer, gym details and fighters arrive in one batched read
+        trainer = db.get_trainer_details(trainer_id)
         if not trainer:
             return jsonify({'error': 'Trainer not found'}), 404
         
-        trainer_dict = dict(trainer)
-        
-        # Add gym details
-        if trainer_dict.get('gym_id'):
-            gym = db.get_gym('gym_id', trainer_dict['gym_id'])
-            if gym:
-                trainer_dict['gym_name'] = gym['name']
-                trainer_dict['gym_location'] = gym['location']
-                trainer_dict['gym_owner'] = gym['owner']
-                trainer_dict['gym_reputation'] = gym['reputation_score']
+        # Gym details are only included when the trainer has a gym
+        if trainer['gym_name'] is None:
+            for key in ('gym_name', 'gym_location', 'gym_owner', 'gym_reputation'):
+                trainer.pop(key)
         
         # Get fighter count
-        fighters = db.get_trainer_fighters(trainer_id)
-        trainer_dict['fighter_count'] = len(fighters) if fighters else 0
+        trainer['fighter_count'] = len(trainer.pop('fighters'))
         
-        return jsonify(trainer_dict)
+        return jsonify(trainer)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -455,6 +720,7 @@ def update_trainer_gym(trainer_id):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/trainers/<int:trainer_id>/fighters', methods=['GET'])
+@conditional('fighter_trainer', 'fighters')
 def get_trainer_fighters_api(trainer_id):
     """Get all fighters for a trainer"""
     try:
@@ -462,7 +728,7 @@ def get_trainer_fighters_api(trainer_id):
         if not fighters:
             return jsonify([])
         
-        return jsonify([dict(fighter) for fighter in fighters])
+        return jsonify(fighters)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -493,33 +759,25 @@ def remove_fighter_from_trainer_api(trainer_id, fighter_id):
 # Add these gym API routes to app.py
 
 @app.route('/api/gyms/<int:gym_id>', methods=['GET'])
+@conditional('gyms', 'fighters', 'fighter_records', 'trainers')
 def get_gym_details(gym_id):
     """Get detailed gym information"""
     try:
-        gym = db.get_gym('gym_id', gym_id)
+        # The gym, its fighters with records and its trainers arrive in one batched read
+        gym = db.get_gym_details(gym_id)
         if not gym:
             return jsonify({'error': 'Gym not found'}), 404
         
-        gym_dict = dict(gym)
-        
-        # Get fighter count
-        fighters = db.get_gym_fighters(gym_id)
-        gym_dict['fighter_count'] = len(fighters) if fighters else 0
+        fighters = gym.pop('fighters')
+        trainers = gym.pop('trainers')
         
-        # Get trainer count
-        trainers = db.get_gym_trainers(gym_id)
-        gym_dict['trainer_count'] = len(trainers) if trainers else 0
+        gym['fighter_count'] = len(fighters)
+        gym['trainer_count'] = len(trainers)
         
         # Calculate total wins for fighters in this gym
-        total_wins = 0
-        if fighters:
-            for fighter in fighters:
-                record = db.get_fighter_with_record(fighter['fighter_id'])
-                if record and 'wins' in record:
-                    total_wins += record.get('wins', 0)
-        gym_dict['total_wins'] = total_wins
-        
-        return jsonify(gym_dict)
+        gym['total_wins'] = sum(fighter['wins'] or 0 for fighter in fighters)
+        
+        return jsonify(gym)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -571,32 +829,21 @@ def delete_gym_api(gym_id):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/gyms/<int:gym_id>/fighters', methods=['GET'])
+@conditional('fighters', 'fighter_records', 'gyms')
 def get_gym_fighters_api(gym_id):
     """Get all fighters for a gym"""
     try:
-        fighters = db.get_gym_fighters(gym_id)
+        # Fighter records are joined in by the same query
+        fighters = db.get_gym_fighters(gym_id, include_details=True)
         if not fighters:
             return jsonify([])
         
-        # Enhance with fighter records
-        enhanced_fighters = []
-        for fighter in fighters:
-            fighter_dict = dict(fighter)
-            
-            # Get fighter record
-            record = db.get_fighter_with_record(fighter_dict['fighter_id'])
-            if record:
-                fighter_dict['wins'] = record.get('wins', 0)
-                fighter_dict['losses'] = record.get('losses', 0)
-                fighter_dict['draws'] = record.get('draws', 0)
-            
-            enhanced_fighters.append(fighter_dict)
-        
-        return jsonify(enhanced_fighters)
+        return jsonify(fighters)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/gyms/<int:gym_id>/trainers', methods=['GET'])
+@conditional('trainers')
 def get_gym_trainers_api(gym_id):
     """Get all trainers for a gym"""
     try:
@@ -604,26 +851,47 @@ def get_gym_trainers_api(gym_id):
         if not trainers:
             return jsonify([])
         
-        return jsonify([dict(trainer) for trainer in trainers])
+        return jsonify(trainers)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # Gym API Routes
 @app.route('/api/gyms', methods=['GET'])
+@conditional('gyms', 'fighters', 'trainers')
 def get_gyms():
-    """Get all gyms"""
+    """Get all gyms, optionally with member counts (?include=counts) and lists (?include=members)"""
     try:
         search_term = request.args.get('search', '')
+        include = {item for item in request.args.get('include', '').split(',') if item}
+        
+        invalid = include - {'counts', 'members'}
+        if invalid:
+            return jsonify({'error': f'Invalid include value: {", ".join(sorted(invalid))}'}), 400
+        
+        include_counts = 'counts' in include
+        include_members = 'members' in include
+        
+        fields = fields_arg()
+        file_format = stream_format()
+        if file_format:
+            return stream_response(db.stream_gyms(include_counts=include_counts, include_members=include_members,
+                                                  fields=fields),
+                                   file_format, 'gyms', db.get_table_count('gyms'))
+        
+        limit, cursor = page_args()
         
         if search_term:
-            gyms = db.search_gyms(search_term, limit=100)
+            gyms = db.search_gyms(search_term, limit=limit, include_counts=include_counts,
+                                  include_members=include_members, cursor=cursor, fields=fields)
         else:
-            gyms = db.get_all_gyms(limit=100)
+            gyms = db.get_all_gyms(limit=limit, include_counts=include_counts,
+                                   include_members=include_members, cursor=cursor, fields=fields)
         
-        if not gyms:
-            return jsonify([])
-        
-        return jsonify([dict(gym) for gym in gyms])
+        # Unfiltered totals come from the trigger-maintained counters, not a COUNT(*) scan
+        total = None if search_term else db.get_table_count('gyms')
+        return page_response(gyms, total)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -653,38 +921,52 @@ def create_gym():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/gyms/bulk', methods=['POST'])
+@require_login
+def create_gyms_bulk():
+    """Create gyms from a JSON array; nothing is created unless every row is valid"""
+    try:
+        return bulk_create(parse_gym_row, db.create_gyms_bulk, check_rows=check_gym_rows)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Trainer API Routes
 @app.route('/api/trainers', methods=['GET'])
+@conditional('trainers', 'gyms')
 def get_trainers():
-    """Get all trainers"""
+    """Get all trainers, optionally filtered by specialty and gym_id"""
     try:
         search_term = request.args.get('search', '')
         
-        if search_term:
-            trainers = db.search_trainers(search_term, limit=100)
-        else:
-            trainers = db.get_all_trainers(limit=100)
+        fields = fields_arg()
+        filters = trainer_filters()
+        filtered = any(value is not None for value in filters.values())
         
-        if not trainers:
-            return jsonify([])
+        file_format = stream_format()
+        if file_format:
+            return stream_response(db.stream_trainers(include_details=True, fields=fields, filters=filters),
+                                   file_format, 'trainers', None if filtered else db.get_table_count('trainers'))
         
-        # Enhance with gym info
-        enhanced_trainers = []
-        for trainer in trainers:
-            trainer_dict = dict(trainer)
-            
-            if trainer_dict.get('gym_id'):
-                gym = db.get_gym('gym_id', trainer_dict['gym_id'])
-                if gym:
-                    trainer_dict['gym_name'] = gym['name']
-            
-            enhanced_trainers.append(trainer_dict)
+        limit, cursor = page_args()
         
-        return jsonify(enhanced_trainers)
+        # Gym names are joined in by the same query
+        if search_term:
+            trainers = db.search_trainers(search_term, limit=limit, include_details=True, cursor=cursor,
+                                          fields=fields, filters=filters)
+        else:
+            trainers = db.get_all_trainers(limit=limit, include_details=True, cursor=cursor, fields=fields,
+                                           filters=filters)
+        
+        # Unfiltered totals come from the trigger-maintained counters, not a COUNT(*) scan
+        total = None if search_term or filtered else db.get_table_count('trainers')
+        return page_response(trainers, total)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/fighters/<int:fighter_id>/trainers', methods=['GET'])
+@conditional('fighter_trainer', 'trainers')
 def get_fighter_trainers(fighter_id):
     """Get all trainers for a fighter"""
     try:
@@ -692,7 +974,7 @@ def get_fighter_trainers(fighter_id):
         if not trainers:
             return jsonify([])
         
-        return jsonify([dict(trainer) for trainer in trainers])
+        return jsonify(trainers)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -757,45 +1039,131 @@ def remove_fighter_trainer(fighter_id, trainer_id):
 
 # Match API Routes (for completeness)
 @app.route('/api/matches', methods=['GET'])
+@conditional('match_events', 'participants', 'fighters')
 def get_matches():
     """Get all matches"""
     try:
         search_term = request.args.get('search', '')
         
+        fields = fields_arg()
+        file_format = stream_format()
+        if file_format:
+            return stream_response(db.stream_matches(fields=fields), file_format, 'matches',
+                                   db.get_table_count('match_events'))
+        
+        limit, cursor = page_args()
+        
         if search_term:
-            matches = db.search_matches(search_term, limit=100)
+            matches = db.search_matches(search_term, limit=limit, cursor=cursor, fields=fields)
         else:
-            matches = db.get_all_matches(limit=100)
-                
-        if matches is None:
-            return jsonify([])
+            matches = db.get_all_matches(limit=limit, cursor=cursor, fields=fields)
         
-        # Convert to list of dicts
-        matches_list = []
-        for match in matches:
-            match_dict = dict(match)
-            
-            # Get fighter details for each match
-            match_id = match_dict['match_id']
-            fighter_details = db.get_match_fighters(match_id)
-            if fighter_details:
-                match_dict.update(dict(fighter_details))
-            
-            matches_list.append(match_dict)
-        
-        return jsonify(matches_list)
+        # Fighter details and duration already come back with each match
+        # Unfiltered totals come from the trigger-maintained counters, not a COUNT(*) scan
+        total = None if search_term else db.get_table_count('match_events')
+        return page_response(matches, total)
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/autocomplete/<entity>')
+def autocomplete(entity):
+    """Fighters, trainers or gyms whose name starts with ?prefix=, for the pickers; ?without_gym=1 skips gym members"""
+    if entity not in AUTOCOMPLETE_SOURCES:
+        return jsonify({'error': f'Unknown entity: {entity}'}), 404
+    
+    try:
+        prefix = request.args.get('prefix', '').strip()
+        limit = max(1, min(request.args.get('limit', 10, type=int), MAX_AUTOCOMPLETE_RESULTS))
+        
+        without_gym = request.args.get('without_gym') == '1'
+        
+        rows = db.autocomplete(entity, prefix, limit, without_gym)
+        if rows is None:
+            return jsonify({'error': f'Failed to load {entity}'}), 500
+        
+        response = jsonify(rows)
+        response.headers['Cache-Control'] = f'private, max-age={AUTOCOMPLETE_TTL}'
+        return response
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/changes')
+@require_login
+def get_changes():
+    """Rows written and keys deleted since ?since=, so clients can keep a copy of the tables in sync"""
+    try:
+        limit = max(1, min(request.args.get('limit', MAX_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+        tables = request.args.get('tables')
+        if tables is not None:
+            tables = [table.strip() for table in tables.split(',') if table.strip()]
+        
+        # Each response's next token is the since of the following request; has_more asks for it right away
+        result = db.get_changes(request.args.get('since') or None, limit, tables)
+        if result is None:
+            return jsonify({'error': 'Failed to load changes'}), 500
+        
+        changes, next_token, more = result
+        response = jsonify({'changes': changes, 'next': next_token, 'has_more': more})
+        response.headers['Cache-Control'] = 'private, no-store'
+        return response
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/events')
+@require_login
+def stream_events():
+    """Server-Sent Events stream naming the tables each committed write changed, so pages update without polling"""
+    # Subscribed before streaming, so a full server can still answer with an error
+    subscriber = db.listener.subscribe(limit=EVENTS_MAX_SUBSCRIBERS)
+    if subscriber is None:
+        response = Response(f'retry: {EVENTS_RETRY_AFTER * 1000}\n\n', status=503, mimetype='text/event-stream')
+        response.headers['Retry-After'] = str(EVENTS_RETRY_AFTER)
+        return response
+
+    def events():
+        # Browsers reconnect on their own, waiting this long after the connection drops
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                tables = {subscriber.get(timeout=EVENTS_HEARTBEAT)}
+            except queue.Empty:
+                yield ': heartbeat\n\n'
+                continue
+            
+            # Everything that arrived meanwhile goes out as one event
+            while True:
+                try:
+                    tables.add(subscriber.get_nowait())
+                except queue.Empty:
+                    break
+            
+            # None stands for changes that may have been missed, which could have touched any table
+            changed = VERSIONED_TABLES if None in tables else sorted(tables)
+            yield f"event: change\ndata: {json.dumps({'tables': changed})}\n\n"
+    
+    # The stream never touches the request's unit of work: each open tab only holds a queue, not a connection.
+    # The queue is released when the response closes, even if the stream was never started.
+    response = Response(events(), mimetype='text/event-stream')
+    response.call_on_close(lambda: db.listener.unsubscribe(subscriber))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 # Utility routes
 @app.route('/api/fighters/without-gym')
 def get_fighters_without_gym():
     """Get fighters without gym affiliation"""
     try:
         fighters = db.get_all_fighters_without_gym()
-        return jsonify([dict(fighter) for fighter in fighters]) if fighters else jsonify([])
+        return jsonify(fighters or [])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -804,7 +1172,7 @@ def get_trainers_without_gym():
     """Get trainers without gym affiliation"""
     try:
         trainers = db.get_all_trainers_without_gym()
-        return jsonify([dict(trainer) for trainer in trainers]) if trainers else jsonify([])
+        return jsonify(trainers or [])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -826,68 +1194,32 @@ def gyms():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    offset = (page - 1) * per_page
+    per_page, cursor = page_args(default_limit=20)
     
     search_term = request.args.get('search', '')
     
     if search_term:
-        gyms_list = db.search_gyms(search_term, limit=per_page)
-        total_gyms = len(gyms_list) if gyms_list else 0
+        gyms_list = db.search_gyms(search_term, limit=per_page, cursor=cursor)
     else:
-        gyms_list = db.get_all_gyms(limit=per_page)
-        total_gyms = len(gyms_list) if gyms_list else 0
-    
-    total_pages = (total_gyms + per_page - 1) // per_page
+        gyms_list = db.get_all_gyms(limit=per_page, cursor=cursor)
     
     return render_template('gyms.html', 
                          gyms=gyms_list,
-                         page=page, 
-                         total_pages=total_pages,
+                         cursor=cursor,
+                         next_cursor=getattr(gyms_list, 'next_cursor', None),
                          search_term=search_term)
 
 @app.route('/api/matches/<int:match_id>', methods=['GET'])
+@conditional('match_events', 'participants', 'fighters')
 def get_match_details(match_id):
     """Get detailed match information"""
-    try:        
-        # Get match details
-        match_details = db.execute("""
-            SELECT 
-                match_id, 
-                start_date, 
-                end_date, 
-                EXTRACT(EPOCH FROM (end_date - start_date)) as duration_seconds,
-                location
-            FROM match_events WHERE match_id = %s
-        """, (match_id,), fetchone=True)
-        
-        if not match_details:
+    try:
+        # Match details, both fighters and the formatted duration in one query
+        match = db.get_match(match_id)
+        if not match:
             return jsonify({'error': 'Match not found'}), 404
         
-        # Convert to serializable dictionary
-        result = convert_to_dict(match_details)
-        
-        # Get fighter details
-        fighters = db.get_match_fighters(match_id)
-        if fighters:
-            fighters_dict = convert_to_dict(fighters)
-            result.update(fighters_dict)
-        
-        # Convert duration_seconds to duration string
-        if 'duration_seconds' in result and result['duration_seconds']:
-            total_seconds = int(result['duration_seconds'])
-            hours = total_seconds // 3600
-            minutes = (total_seconds % 3600) // 60
-            seconds = total_seconds % 60
-            result['duration'] = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-        else:
-            result['duration'] = None
-        
-        # Remove duration_seconds
-        result.pop('duration_seconds', None)
-        
-        return jsonify(result)
+        return jsonify(match)
     except Exception as e:
         print(f"Error getting match details: {e}")
         return jsonify({'error': str(e)}), 500
@@ -900,7 +1232,7 @@ def update_match_api(match_id):
         data = request.get_json()
         
         # Check if match exists
-        match = db.execute("SELECT * FROM match_events WHERE match_id = %s", (match_id,), fetchone=True)
+        match = db.execute("SELECT match_id FROM match_events WHERE match_id = %s", (match_id,), fetchone=True)
         if not match:
             return jsonify({'error': 'Match not found'}), 404
         
@@ -992,33 +1324,34 @@ def create_match_api():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/matches/bulk', methods=['POST'])
+@require_login
+def create_matches_bulk():
+    """Create matches from a JSON array; nothing is created unless every row is valid"""
+    try:
+        return bulk_create(parse_match_row, db.create_matches_bulk,
+                           references=[((3, 4), 'fighters', 'fighter_id', 'Fighter')], check_rows=check_match_rows)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/trainers')
 def trainers():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    offset = (page - 1) * per_page
+    per_page, cursor = page_args(default_limit=20)
     
     search_term = request.args.get('search', '')
     
     if search_term:
-        trainers_list = db.search_trainers(search_term, limit=per_page)
-        total_trainers = len(trainers_list) if trainers_list else 0
+        trainers_list = db.search_trainers(search_term, limit=per_page, cursor=cursor)
     else:
-        trainers_list = db.get_all_trainers(limit=per_page)
-        total_trainers = len(trainers_list) if trainers_list else 0
-    
-    total_pages = (total_trainers + per_page - 1) // per_page
-    
-    gyms = db.get_all_gyms()
+        trainers_list = db.get_all_trainers(limit=per_page, cursor=cursor)
     
     return render_template('trainers.html', 
                          trainers=trainers_list,
-                         gyms=gyms,
-                         page=page, 
-                         total_pages=total_pages,
+                         cursor=cursor,
+                         next_cursor=getattr(trainers_list, 'next_cursor', None),
                          search_term=search_term)
 
 @app.route('/matches')
@@ -1026,28 +1359,19 @@ def matches():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    offset = (page - 1) * per_page
+    per_page, cursor = page_args(default_limit=20)
     
     search_term = request.args.get('search', '')
     
     if search_term:
-        matches_list = db.search_matches(search_term, limit=per_page)
-        total_matches = len(matches_list) if matches_list else 0
+        matches_list = db.search_matches(search_term, limit=per_page, cursor=cursor)
     else:
-        matches_list = db.get_all_matches(limit=per_page)
-        total_matches = len(matches_list) if matches_list else 0
-    
-    total_pages = (total_matches + per_page - 1) // per_page
-    
-    fighters = db.get_all_fighters()
+        matches_list = db.get_all_matches(limit=per_page, cursor=cursor)
     
     return render_template('matches.html', 
                          matches=matches_list,
-                         fighters=fighters,
-                         page=page, 
-                         total_pages=total_pages,
+                         cursor=cursor,
+                         next_cursor=getattr(matches_list, 'next_cursor', None),
                          search_term=search_term)
 
 @app.route('/view/fighter/<int:fighter_id>')
@@ -1062,16 +1386,12 @@ def view_fighter(fighter_id):
     trainers = db.get_fighter_trainers(fighter_id)
     matches = db.get_fighter_matches(fighter_id)
     gym = db.get_gym('gym_id', fighter['gym_id']) if fighter['gym_id'] else None # type: ignore
-    all_trainers = db.get_all_trainers()
-    gyms = db.get_all_gyms()
     
     return render_template('view_fighter.html', 
                          fighter=fighter, 
                          trainers=trainers, 
                          matches=matches, 
-                         gym=gym,
-                         all_trainers=all_trainers,
-                         gyms=gyms)
+                         gym=gym)
 
 @app.route('/view/gym/<int:gym_id>')
 def view_gym(gym_id):
@@ -1084,15 +1404,12 @@ def view_gym(gym_id):
     
     fighters = db.get_gym_fighters(gym_id)
     trainers = db.get_gym_trainers(gym_id)
-    all_fighters = db.get_all_fighters_without_gym()
-    all_trainers = db.get_all_trainers_without_gym()
     
+    # The add fighter and add trainer pickers look candidates up through /api/autocomplete?without_gym=1
     return render_template('view_gym.html', 
                          gym=gym, 
                          fighters=fighters, 
-                         trainers=trainers,
-                         all_fighters=all_fighters,
-                         all_trainers=all_trainers)
+                         trainers=trainers)
 
 @app.route('/view/trainer/<int:trainer_id>')
 def view_trainer(trainer_id):
@@ -1105,15 +1422,11 @@ def view_trainer(trainer_id):
     
     fighters = db.get_trainer_fighters(trainer_id)
     gym = db.get_gym('gym_id', trainer['gym_id']) if trainer['gym_id'] else None # type: ignore
-    all_fighters = db.get_all_fighters_without_trainer(trainer_id)
-    gyms = db.get_all_gyms()
     
     return render_template('view_trainer.html', 
                          trainer=trainer, 
                          fighters=fighters, 
-                         gym=gym,
-                         all_fighters=all_fighters,
-                         gyms=gyms)
+                         gym=gym)
 
 @app.route('/view/match/<int:match_id>')
 def view_match(match_id):
@@ -1125,15 +1438,14 @@ def view_match(match_id):
         return jsonify({'error': 'Match not found'}), 404
     
     match_details = db.execute("""
-        SELECT * FROM match_events WHERE match_id = %s
+        SELECT match_id, start_date, end_date, duration, location
+        FROM match_events
+        WHERE match_id = %s
     """, (match_id,), fetchone=True)
     
-    fighters = db.get_all_fighters()
-    
     return render_template('view_match.html', 
                          match=match, 
-                         match_details=match_details,
-                         fighters=fighters)
+                         match_details=match_details)
 
 # =================== UPDATE MATCH FIGHTERS ===================
 
@@ -1204,19 +1516,39 @@ def utility_processor():
     
     return dict(format_datetime=format_datetime, format_date=format_date)
 
+@app.route('/api/search')
+def search_everything():
+    """Ranked full-text search across fighters, gyms, trainers and matches (?q=, ?limit= per type)"""
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 5, type=int), 50))
+    
+    try:
+        results = db.search_all(query, limit=limit)
+        if results is None:
+            raise RuntimeError('Search failed')
+        
+        return jsonify(results)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/stats')
 def get_stats():
+    """Get dashboard counts, exact from maintained counters or approximate from planner statistics (?mode=)"""
+    mode = request.args.get('mode', 'exact')
+    if mode not in ('exact', 'approximate'):
+        return jsonify({'error': f'Invalid mode: {mode}', 'success': False}), 400
+    
     try:
-        fighters = db.execute("SELECT COUNT(*) as count FROM fighters", fetchone=True)['count']
-        gyms = db.execute("SELECT COUNT(*) as count FROM gyms", fetchone=True)['count']
-        trainers = db.execute("SELECT COUNT(*) as count FROM trainers", fetchone=True)['count']
-        matches = db.execute("SELECT COUNT(*) as count FROM match_events", fetchone=True)['count']
+        counts = db.get_table_counts(mode)
+        if counts is None:
+            raise RuntimeError('Failed to fetch counts')
         
         return jsonify({
-            'fighters': fighters,
-            'gyms': gyms,
-            'trainers': trainers,
-            'matches': matches,
+            'fighters': counts['fighters'],
+            'gyms': counts['gyms'],
+            'trainers': counts['trainers'],
+            'matches': counts['matches'],
+            'mode': mode,
             'success': True
         })
     except Exception as e:
@@ -1229,5 +1561,23 @@ def get_stats():
             'success': False
         })
 
+@app.route('/api/stats/pool')
+@require_login
+def get_pool_stats():
+    """Get database connection pool statistics"""
+    return jsonify(db.pool_stats())
+
+@app.route('/api/stats/cache')
+@require_login
+def get_cache_stats():
+    """Get query cache hit/miss statistics"""
+    return jsonify(db.cache_stats())
+
+@app.route('/api/stats/events')
+@require_login
+def get_events_stats():
+    """Get change listener statistics"""
+    return jsonify(db.listener_stats())
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -1,26 +1,605 @@
 import os
-import psycopg2
-from psycopg2 import Error
+import re
+import json
+import base64
+import threading
+from contextlib import contextmanager
+from psycopg2 import Error, errors, extensions
 from dotenv import load_dotenv
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from pool import ConnectionPool
+from query_cache import create_cache
+from listener import ChangeListener
 
 load_dotenv()
 
+WEIGHT_CLASSES = ('Strawweight', 'Flyweight', 'Bantamweight', 'Featherweight', 'Lightweight', 'Welterweight',
+                  'Middleweight', 'Light Heavyweight', 'Heavyweight', 'Catchweight')
+FIGHTER_STATUSES = ('active', 'retired', 'suspended')
+
+# Rows per multi-row INSERT in the bulk create methods
+BULK_PAGE_SIZE = 1000
+
+# Columns each list can return, by field name; ?fields= picks from these and only the picked ones are selected
+FIGHTER_FIELDS = {
+    "fighter_id": "f.fighter_id",
+    "name": "f.name",
+    "nickname": "f.nickname",
+    "weight_class": "f.weight_class",
+    "height": "f.height",
+    "age": "f.age",
+    "nationality": "f.nationality",
+    "status": "f.status",
+    "gym_id": "f.gym_id",
+}
+TRAINER_FIELDS = {
+    "trainer_id": "t.trainer_id",
+    "name": "t.name",
+    "specialty": "t.specialty",
+    "gym_id": "t.gym_id",
+}
+GYM_FIELDS = {
+    "gym_id": "g.gym_id",
+    "name": "g.name",
+    "location": "g.location",
+    "owner": "g.owner",
+    "reputation_score": "g.reputation_score",
+}
+FIGHTER_COLUMNS = ", ".join(FIGHTER_FIELDS.values())
+TRAINER_COLUMNS = ", ".join(TRAINER_FIELDS.values())
+GYM_COLUMNS = ", ".join(GYM_FIELDS.values())
+
+# include_details=True adds the win/loss/draw record and gym name through joins instead of per-row lookups
+FIGHTER_DETAIL_FIELDS = {
+    "wins": "fr.wins",
+    "losses": "fr.losses",
+    "draws": "fr.draws",
+    "gym_name": "g.name AS gym_name",
+}
+FIGHTER_DETAIL_COLUMNS = FIGHTER_COLUMNS + ", " + ", ".join(FIGHTER_DETAIL_FIELDS.values())
+FIGHTER_DETAIL_JOINS = """
+    LEFT JOIN fighter_records fr ON fr.fighter_id = f.fighter_id
+    LEFT JOIN gyms g ON g.gym_id = f.gym_id
+"""
+TRAINER_DETAIL_FIELDS = {
+    "gym_name": "g.name AS gym_name",
+}
+TRAINER_DETAIL_COLUMNS = TRAINER_COLUMNS + ", " + ", ".join(TRAINER_DETAIL_FIELDS.values())
+TRAINER_DETAIL_JOINS = "LEFT JOIN gyms g ON g.gym_id = t.gym_id"
+
+GYM_COUNT_FIELDS = {
+    "fighter_count": "(SELECT count(*) FROM fighters f WHERE f.gym_id = g.gym_id) AS fighter_count",
+    "trainer_count": "(SELECT count(*) FROM trainers t WHERE t.gym_id = g.gym_id) AS trainer_count",
+}
+GYM_MEMBER_FIELDS = {
+    "fighters": """
+        (SELECT COALESCE(json_agg(json_build_object(
+                    'fighter_id', f.fighter_id, 'name', f.name, 'nickname', f.nickname,
+                    'weight_class', f.weight_class, 'status', f.status
+                ) ORDER BY f.name), '[]')
+         FROM fighters f WHERE f.gym_id = g.gym_id) AS fighters""",
+    "trainers": """
+        (SELECT COALESCE(json_agg(json_build_object(
+                    'trainer_id', t.trainer_id, 'name', t.name, 'specialty', t.specialty
+                ) ORDER BY t.name), '[]')
+         FROM trainers t WHERE t.gym_id = g.gym_id) AS trainers""",
+}
+
+def select_fields(available, fields=None, keys=()):
+    # The select list for the requested fields, in allowlist order. Key columns are always selected,
+    # since links, pages and cursors are built from them. fields=None selects everything.
+    if fields is None:
+        return ", ".join(available.values())
+
+    unknown = set(fields) - available.keys()
+    if unknown:
+        raise ValueError(f"Invalid fields: {', '.join(sorted(unknown))}")
+    return ", ".join(column for name, column in available.items() if name in fields or name in keys)
+
+def fighter_columns(include_details=False, fields=None):
+    # Returns the select list and joins; the detail joins are skipped when no detail field is selected
+    if not include_details:
+        return select_fields(FIGHTER_FIELDS, fields, ["fighter_id"]), ""
+
+    joins = FIGHTER_DETAIL_JOINS if fields is None or FIGHTER_DETAIL_FIELDS.keys() & set(fields) else ""
+    return select_fields({**FIGHTER_FIELDS, **FIGHTER_DETAIL_FIELDS}, fields, ["fighter_id"]), joins
+
+def trainer_columns(include_details=False, fields=None):
+    if not include_details:
+        return select_fields(TRAINER_FIELDS, fields, ["trainer_id"]), ""
+
+    joins = TRAINER_DETAIL_JOINS if fields is None or TRAINER_DETAIL_FIELDS.keys() & set(fields) else ""
+    return select_fields({**TRAINER_FIELDS, **TRAINER_DETAIL_FIELDS}, fields, ["trainer_id"]), joins
+
+def gym_columns(include_counts=False, include_members=False, fields=None):
+    # Counts and member lists are correlated subqueries, so a page of gyms is still a single query
+    available = dict(GYM_FIELDS)
+    if include_counts:
+        available.update(GYM_COUNT_FIELDS)
+    if include_members:
+        available.update(GYM_MEMBER_FIELDS)
+    return select_fields(available, fields, ["gym_id"])
+
+# Tables with trigger-maintained counters in table_counts, and the names they are reported under
+COUNTED_TABLES = {
+    "fighters": "fighters",
+    "gyms": "gyms",
+    "trainers": "trainers",
+    "match_events": "matches",
+}
+
+# Every table cached query results can be read from
+TABLES = ("gyms", "fighters", "trainers", "fighter_trainer", "match_events", "participants", "fighter_records",
+          "table_counts")
+
+# Tables whose writes bump their version in table_versions, which the API's ETags are computed from
+VERSIONED_TABLES = [table for table in TABLES if table != "table_counts"]
+
+# The same triggers NOTIFY this channel with the table's name once the writing transaction commits
+CHANGE_CHANNEL = "table_changes"
+
+# Tables clients can sync incrementally with get_changes(): (key columns, columns of a changed row).
+# Every row carries the transaction id of its last write in row_version; deletes leave a tombstone in deleted_rows.
+CHANGE_SOURCES = {
+    "gyms": (["gym_id"], "gym_id, name, location, owner, reputation_score"),
+    "fighters": (["fighter_id"], "fighter_id, name, nickname, weight_class, height, age, nationality, status, gym_id"),
+    "trainers": (["trainer_id"], "trainer_id, name, specialty, gym_id"),
+    "match_events": (["match_id"], "match_id, start_date, end_date, duration, location"),
+    "participants": (["match_id", "fighter_id"], "match_id, fighter_id, result"),
+}
+# Maintained by the database, never copied between databases
+CHANGE_COLUMNS = ("updated_at", "row_version")
+
+# Other tables a write to a table can change, through foreign key actions (ON DELETE SET NULL / CASCADE)
+# and the fighter_records triggers. The table_counts triggers are added for COUNTED_TABLES in written_tables().
+WRITE_SIDE_EFFECTS = {
+    "gyms": ("fighters", "trainers"),
+    "fighters": ("fighter_trainer", "participants"),
+    "trainers": ("fighter_trainer",),
+    "match_events": ("participants",),
+    "participants": ("fighter_records",),
+}
+
+def written_tables(tables):
+    # The given tables plus everything writing to them can change in turn
+    written = set()
+    pending = list(tables)
+    while pending:
+        table = pending.pop()
+        if table in written:
+            continue
+        written.add(table)
+        pending.extend(WRITE_SIDE_EFFECTS.get(table, ()))
+        if table in COUNTED_TABLES:
+            pending.append("table_counts")
+    return written
+
+def copy_result(result):
+    # Cached rows are shared between requests, so callers only ever get copies they are free to modify
+    if result is None:
+        return None
+    if isinstance(result, list):
+        return [dict(row) for row in result]
+    return dict(result)
+
+# Columns searched with ILIKE '%term%', each backed by a pg_trgm GIN index
+TRIGRAM_INDEXES = {
+    "fighters": ["name", "nickname"],
+    "gyms": ["name", "location", "owner"],
+    "trainers": ["name", "specialty"],
+    "match_events": ["location"],
+}
+
+# Generated tsvector columns behind the unified search, with the more specific fields weighted higher
+SEARCH_VECTORS = {
+    "fighters": "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+                "setweight(to_tsvector('simple', coalesce(nickname, '')), 'B')",
+    "gyms": "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(location, '')), 'B') || "
+            "setweight(to_tsvector('simple', coalesce(owner, '')), 'C')",
+    "trainers": "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+                "setweight(to_tsvector('simple', coalesce(specialty, '')), 'B')",
+    "match_events": "setweight(to_tsvector('simple', coalesce(location, '')), 'A')",
+}
+
+# Secondary indexes managed by ensure_indexes(): (name, table, definition after "ON table").
+# fighter_trainer.fighter_id is already covered by the leading column of its UNIQUE index.
+# The list filters end in the id so a filtered page is read in keyset order straight from the index.
+# A fighter's matches come from an index-only scan; otherwise a skip scan over participants_row_version_idx
+# (PostgreSQL 18) can look just as cheap.
+INDEXES = [
+    ("fighters_gym_id_fighter_id_idx", "fighters", "(gym_id, fighter_id)"),
+    ("fighters_weight_class_status_fighter_id_idx", "fighters", "(weight_class, status, fighter_id)"),
+    ("fighters_status_fighter_id_idx", "fighters", "(status, fighter_id)"),
+    ("fighters_nationality_fighter_id_idx", "fighters", "(nationality, fighter_id)"),
+    ("trainers_gym_id_trainer_id_idx", "trainers", "(gym_id, trainer_id)"),
+    ("trainers_specialty_trainer_id_idx", "trainers", "(specialty, trainer_id)"),
+    ("fighter_trainer_trainer_id_idx", "fighter_trainer", "(trainer_id)"),
+    ("participants_fighter_id_match_id_idx", "participants", "(fighter_id, match_id)"),
+    ("match_events_start_date_idx", "match_events", "(start_date)"),
+]
+INDEXES += [
+    (f"{table}_{column}_trgm_idx", table, f"USING gin ({column} gin_trgm_ops)")
+    for table, columns in TRIGRAM_INDEXES.items() for column in columns
+]
+INDEXES += [(f"{table}_search_idx", table, "USING gin (search_vector)") for table in SEARCH_VECTORS]
+# get_changes() reads each table in (row_version, key) order from the given version on
+INDEXES += [
+    (f"{table}_row_version_idx", table, f"(row_version, {', '.join(keys)})")
+    for table, (keys, _) in CHANGE_SOURCES.items()
+]
+INDEXES += [("deleted_rows_row_version_idx", "deleted_rows", "(row_version, deleted_id)")]
+
+# Picker lookups by name prefix, by entity: (columns, FROM clause, name column, id column, tables read)
+AUTOCOMPLETE_SOURCES = {
+    "fighters": ("f.fighter_id, f.name, f.nickname, f.weight_class, f.nationality, f.status, "
+                 "fr.wins, fr.losses, fr.draws",
+                 "fighters f LEFT JOIN fighter_records fr ON fr.fighter_id = f.fighter_id", "f.name", "f.fighter_id",
+                 ("fighters", "fighter_records")),
+    "trainers": ("t.trainer_id, t.name, t.specialty, t.gym_id, g.name AS gym_name",
+                 "trainers t LEFT JOIN gyms g ON g.gym_id = t.gym_id", "t.name", "t.trainer_id",
+                 ("trainers", "gyms")),
+    "gyms": ("g.gym_id, g.name, g.location, g.owner, g.reputation_score", "gyms g", "g.name", "g.gym_id",
+             ("gyms",)),
+}
+# text_pattern_ops serves both the LIKE 'prefix%' range and the ~<~ order, so a lookup reads only the rows it returns
+INDEXES += [
+    (f"{table}_name_prefix_idx", table, f"(lower(name) text_pattern_ops, {key.split('.')[1]})")
+    for table, (_, _, _, key, _) in AUTOCOMPLETE_SOURCES.items()
+]
+
+# The gym pages only offer fighters and trainers without a gym; partial indexes keep those lookups as short
+INDEXES += [
+    (f"{table}_name_prefix_no_gym_idx", table,
+     f"(lower(name) text_pattern_ops, {AUTOCOMPLETE_SOURCES[table][3].split('.')[1]}) WHERE gym_id IS NULL")
+    for table in ("fighters", "trainers")
+]
+
+# Indexes superseded by the ones above, dropped by ensure_indexes()
+RETIRED_INDEXES = ["fighters_gym_id_idx", "trainers_gym_id_idx", "participants_fighter_id_idx"]
+
+# Lookups behind the gym, trainer, fighter and match pages; none of them should need a sequential scan
+HOT_QUERIES = {
+    "gym_fighters": ("SELECT fighter_id FROM fighters WHERE gym_id = %s", (1,)),
+    "gym_trainers": ("SELECT trainer_id FROM trainers WHERE gym_id = %s", (1,)),
+    "fighter_trainers": ("SELECT trainer_id FROM fighter_trainer WHERE fighter_id = %s", (1,)),
+    "trainer_fighters": ("SELECT fighter_id FROM fighter_trainer WHERE trainer_id = %s", (1,)),
+    "fighter_matches": ("SELECT match_id FROM participants WHERE fighter_id = %s", (1,)),
+    "matches_by_date": ("SELECT match_id FROM match_events WHERE start_date BETWEEN %s AND %s",
+                        ("2024-01-01", "2024-12-31")),
+    "fighters_by_class": ("SELECT fighter_id FROM fighters WHERE weight_class = %s AND status = %s "
+                          "ORDER BY fighter_id DESC LIMIT 100", ("Lightweight", "active")),
+    "fighters_by_nationality": ("SELECT fighter_id FROM fighters WHERE nationality = %s "
+                                "ORDER BY fighter_id DESC LIMIT 100", ("Brazil",)),
+    "trainers_by_specialty": ("SELECT trainer_id FROM trainers WHERE specialty = %s "
+                              "ORDER BY trainer_id DESC LIMIT 100", ("Boxing",)),
+    "fighter_autocomplete": ("SELECT fighter_id FROM fighters WHERE lower(name) LIKE %s "
+                             "ORDER BY lower(name) USING ~<~, fighter_id LIMIT 10", ("ali%",)),
+}
+
+# List filters by name, each a condition on one parameter; ?weight_class=...&min_age=... pick from these
+FIGHTER_FILTERS = {
+    "weight_class": "f.weight_class = %s",
+    "status": "f.status = %s",
+    "gym_id": "f.gym_id = %s",
+    "nationality": "f.nationality = %s",
+    "min_age": "f.age >= %s",
+    "max_age": "f.age <= %s",
+}
+TRAINER_FILTERS = {
+    "specialty": "t.specialty = %s",
+    "gym_id": "t.gym_id = %s",
+}
+
+def like_prefix(text):
+    # LIKE pattern matching anything that starts with text, with the LIKE wildcards in text escaped
+    return re.sub(r"([\\%_])", r"\\\1", text) + "%"
+
+def filter_condition(available, filters=None):
+    # The filters that were given (not None) ANDed together, with their parameters in the same order
+    filters = {name: value for name, value in (filters or {}).items() if value is not None}
+    unknown = filters.keys() - available.keys()
+    if unknown:
+        raise ValueError(f"Invalid filters: {', '.join(sorted(unknown))}")
+    if not filters:
+        return "TRUE", ()
+
+    return " AND ".join(available[name] for name in filters), tuple(filters.values())
+
+def prefix_tsquery(text):
+    # Every word of the input must match the start of a word, so partially typed names still match
+    words = re.findall(r"\w+", text)
+    return " & ".join(f"{word}:*" for word in words)
+
+def search_rank(columns):
+    # Best word similarity of the search term against any searched column; NULL columns are ignored.
+    # Cast to double precision so the rank survives the round trip through a page cursor unchanged.
+    return f"GREATEST({', '.join(f'word_similarity(%s, {column})' for column in columns)})::double precision"
+
+class Page(list):
+    """Rows of one keyset page; next_cursor is None on the last page."""
+
+    def __init__(self, rows=(), next_cursor=None):
+        super().__init__(rows)
+        self.next_cursor = next_cursor
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor.")
+    return values
+
+def keyset_condition(columns, cursor):
+    # Rows that sort after the cursor when ordering by all of the columns descending
+    if not cursor:
+        return "TRUE", ()
+
+    values = decode_cursor(cursor, len(columns))
+    return f"({', '.join(columns)}) < ({', '.join(['%s'] * len(columns))})", tuple(values)
+
+def keyset_page(rows, limit, keys):
+    # Callers fetch limit + 1 rows, the extra one only tells whether another page exists
+    page = Page(rows[:limit])
+    if len(rows) > limit:
+        page.next_cursor = encode_cursor([page[-1][key] for key in keys])
+    return page
+
+def change_condition(since, position, keys):
+    # Rows written from since on that sort after position, the (row_version, *keys) of the last row already sent
+    conditions, params = [], []
+    if since is not None:
+        conditions.append("row_version >= %s::xid8")
+        params.append(since)
+    if position:
+        if not isinstance(position, list) or len(position) != len(keys) + 1:
+            raise ValueError("Invalid cursor.")
+        conditions.append(f"(row_version, {', '.join(keys)}) > (%s::xid8, {', '.join(['%s'] * len(keys))})")
+        params.extend(position)
+    return " AND ".join(conditions) or "TRUE", params
+
+# Matches with both fighters (lowest fighter_id first) and the duration formatted as HH:MM:SS.
+# The lateral lookups use the participants primary key, so listing N matches stays one round trip.
+MATCH_LIST_FIELDS = {
+    "match_id": "m.match_id",
+    "start_date": "m.start_date",
+    "end_date": "m.end_date",
+    "duration": "to_char(make_interval(secs => NULLIF(EXTRACT(EPOCH FROM m.duration), 0)), 'HH24:MI:SS') AS duration",
+    "location": "m.location",
+    "fighter1_id": "f1.fighter_id AS fighter1_id",
+    "fighter1_name": "f1.name AS fighter1_name",
+    "fighter1_nickname": "f1.nickname AS fighter1_nickname",
+    "fighter1_weight_class": "f1.weight_class AS fighter1_weight_class",
+    "fighter1_result": "f1.result AS fighter1_result",
+    "fighter2_id": "f2.fighter_id AS fighter2_id",
+    "fighter2_name": "f2.name AS fighter2_name",
+    "fighter2_nickname": "f2.nickname AS fighter2_nickname",
+    "fighter2_weight_class": "f2.weight_class AS fighter2_weight_class",
+    "fighter2_result": "f2.result AS fighter2_result",
+}
+MATCH_LIST_COLUMNS = ", ".join(MATCH_LIST_FIELDS.values())
+MATCH_LIST_JOINS = """
+    LEFT JOIN LATERAL (
+        SELECT f.fighter_id, f.name, f.nickname, f.weight_class, p.result
+        FROM participants p
+        JOIN fighters f ON f.fighter_id = p.fighter_id
+        WHERE p.match_id = m.match_id
+        ORDER BY p.fighter_id
+        LIMIT 1
+    ) f1 ON true
+    LEFT JOIN LATERAL (
+        SELECT f.fighter_id, f.name, f.nickname, f.weight_class, p.result
+        FROM participants p
+        JOIN fighters f ON f.fighter_id = p.fighter_id
+        WHERE p.match_id = m.match_id AND p.fighter_id > f1.fighter_id
+        ORDER BY p.fighter_id
+        LIMIT 1
+    ) f2 ON true
+"""
+MATCH_LIST_SELECT = f"SELECT {MATCH_LIST_COLUMNS} FROM match_events m {MATCH_LIST_JOINS}"
+
 class Database:
-    def __init__(self):
+    def __init__(self, min_connections=None, max_connections=None, pool_timeout=None,
+                 max_idle=None, max_lifetime=None, check_interval=None, cache_size=None, cache_ttl=None,
+                 cache_url=None):
         self.db_uri = os.environ.get("DB_URI")
 
         if not self.db_uri:
             raise ValueError("Database URI was not found.")
+
+        self.pool = ConnectionPool(
+            self.db_uri,
+            min_size=min_connections if min_connections is not None else int(os.environ.get("DB_POOL_MIN_SIZE", 1)),
+            max_size=max_connections if max_connections is not None else int(os.environ.get("DB_POOL_MAX_SIZE", 10)),
+            timeout=pool_timeout if pool_timeout is not None else float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+            max_idle=max_idle if max_idle is not None else float(os.environ.get("DB_POOL_MAX_IDLE", 300)),
+            max_lifetime=max_lifetime if max_lifetime is not None else float(os.environ.get("DB_POOL_MAX_LIFETIME", 3600)),
+            check_interval=check_interval if check_interval is not None else float(os.environ.get("DB_POOL_CHECK_INTERVAL", 30)),
+            cursor_factory=RealDictCursor
+        )
+
+        # Results of reads that name their tables can be cached. The cache is off unless a backend (DB_CACHE_URL)
+        # or a size (DB_CACHE_SIZE) is set, and a size of 0 turns it off again. The memory:// backend is per
+        # process: with several workers, a write in one doesn't invalidate the others, so use one of the shared
+        # backends of create_cache() there.
+        # Only writes made through this class invalidate it. Anything else writing to these tables (psql, another
+        # program) has to call invalidate_cache(), or its changes show up once the cached entries expire after
+        # the TTL. ../bot.py is no such writer: it keeps its own tables (gym, fighter, ...) and never reads these.
+        cache_url = cache_url if cache_url is not None else os.environ.get("DB_CACHE_URL")
+        if cache_size is None:
+            cache_size = int(os.environ.get("DB_CACHE_SIZE", 1000 if cache_url else 0))
+        cache_ttl = cache_ttl if cache_ttl is not None else float(os.environ.get("DB_CACHE_TTL", 30))
+        self.cache = create_cache(cache_url or "memory://", cache_size, cache_ttl) if cache_size > 0 else None
+        self._local = threading.local()
+        self._query_shapes = {}  # query text -> its columns, for execute_many_queries()
+
+        # One LISTEN connection shared by every /api/events stream, opened by the first subscriber
+        self.listener = ChangeListener(self.db_uri, CHANGE_CHANNEL)
         
     def get_connection(self):
+        scope = getattr(self._local, "scope", None)
+        if scope is not None and scope["conn"] is not None:
+            conn = scope["conn"]
+            # A statement that failed without going through _rollback() leaves the shared transaction aborted;
+            # roll it back so the rest of the request can run, end_unit_of_work() then refuses to commit
+            if conn.info.transaction_status == extensions.TRANSACTION_STATUS_INERROR:
+                self._rollback(conn)
+            return conn
+
         try:
-            return psycopg2.connect(self.db_uri, cursor_factory=RealDictCursor)
+            conn = self.pool.getconn()
         except Error as e:
             print(f"Error connecting to Database:\n{e}")
             return None
+
+        if scope is not None:
+            scope["conn"] = conn
+        return conn
+
+    def release_connection(self, conn):
+        if conn is None or self._in_unit_of_work(conn):
+            return
+        self.pool.putconn(conn)
+
+    def begin_unit_of_work(self):
+        scope = getattr(self._local, "scope", None)
+        if scope is not None:
+            scope["depth"] += 1
+            return
+        self._local.scope = {"conn": None, "depth": 1, "rollback_only": False, "written": set(), "versions": None}
+
+    def end_unit_of_work(self, commit=True):
+        scope = getattr(self._local, "scope", None)
+        if scope is None:
+            return
+        if not commit:
+            scope["rollback_only"] = True
+
+        scope["depth"] -= 1
+        if scope["depth"] > 0:
+            return
+        self._local.scope = None
+
+        conn = scope["conn"]
+        if conn is None:
+            return
+
+        # A statement that failed anywhere in the unit of work rolled back its earlier writes with it, even when
+        # the error was swallowed and the request went on; committing now would report them as saved
+        failed = scope["rollback_only"] or conn.info.transaction_status == extensions.TRANSACTION_STATUS_INERROR
+        try:
+            if failed:
+                conn.rollback()
+                if commit:
+                    raise errors.InFailedSqlTransaction("A statement of the unit of work failed, nothing was committed.")
+            else:
+                conn.commit()
+                self._invalidate(scope["written"])
+        except Error as e:
+            print(f"Error finishing unit of work:\n{e}")
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    @contextmanager
+    def unit_of_work(self):
+        self.begin_unit_of_work()
+        try:
+            yield self
+        except BaseException:
+            self.end_unit_of_work(commit=False)
+            raise
+        self.end_unit_of_work(commit=True)
+
+    def _in_unit_of_work(self, conn):
+        scope = getattr(self._local, "scope", None)
+        return scope is not None and scope["conn"] is conn
+
+    def _commit(self, conn, tables=()):
+        # tables are the ones the transaction wrote to. Cached reads of them are dropped once the write
+        # is committed; inside a unit of work that is when the unit of work ends.
+        tables = written_tables(tables)
+        if not self._in_unit_of_work(conn):
+            conn.commit()
+            self._invalidate(tables)
+        else:
+            self._local.scope["written"].update(tables)
+
+    def _invalidate(self, tables):
+        if self.cache is not None and tables:
+            self.cache.invalidate(tables)
+
+    def use_table_versions(self, tables, versions):
+        # The current unit of work's response is tagged with these versions from get_table_versions(). Its cached
+        # reads are then looked up under them, so a result cached before a write made by another process can't
+        # go out under a tag from after it. Reads of any other table skip the cache.
+        scope = getattr(self._local, "scope", None)
+        if scope is not None:
+            scope["versions"] = dict(zip(tables, versions))
+
+    def _cache_key(self, query, params, fetchone, tables):
+        # None when the read must not go through the cache
+        key = (query, repr(params), fetchone)
+        scope = getattr(self._local, "scope", None)
+        if scope is None or scope["versions"] is None:
+            return key
+        versions = scope["versions"]
+        if not all(table in versions for table in tables):
+            return None
+        return (*key, tuple(versions[table] for table in tables))
+
+    def _has_pending_writes(self, tables):
+        # Writes of the current unit of work are only visible to its own connection until it commits
+        scope = getattr(self._local, "scope", None)
+        return scope is not None and not scope["written"].isdisjoint(tables)
+
+    def _rollback(self, conn):
+        # A failed statement poisons the whole unit of work, so everything is rolled back at the end.
+        conn.rollback()
+        scope = getattr(self._local, "scope", None)
+        if scope is not None and scope["conn"] is conn:
+            scope["rollback_only"] = True
+
+    def invalidate_cache(self, tables):
+        # For writes committed on connections taken straight from the pool, like dbtool's COPY imports
+        self._invalidate(written_tables(tables))
+
+    def pool_stats(self):
+        return self.pool.stats()
+
+    def cache_stats(self):
+        if self.cache is None:
+            return {'enabled': False}
+        return {'enabled': True, **self.cache.stats()}
+
+    def listener_stats(self):
+        return self.listener.stats()
+
+    def close(self):
+        self.listener.close()
+        self.pool.closeall()
         
-    def execute(self, query: str, params=None, fetch=False, fetchone=False):
+    def execute(self, query: str, params=None, fetch=False, fetchone=False, tables=None):
+        # A read that names the tables it depends on is served from the query cache when possible.
+        # Reads of tables the current unit of work has written to always go to the database.
+        cached = (self.cache is not None and tables is not None and (fetch or fetchone)
+                  and not self._has_pending_writes(tables))
+        if cached:
+            key = self._cache_key(query, params, fetchone, tables)
+            cached = key is not None
+        if cached:
+            hit, result = self.cache.get(key)
+            if hit:
+                return copy_result(result)
+            versions = self.cache.versions(tables)
+
         conn = self.get_connection() 
         
         if conn is None:
@@ -37,15 +616,102 @@ class Database:
                 elif fetch:
                     result = cur.fetchall()
                 
-                conn.commit()
-                return result
+                # Which tables an arbitrary statement wrote to is unknown, so anything but a plain read
+                # invalidates the whole cache
+                self._commit(conn, () if cur.statusmessage.startswith("SELECT") else TABLES)
             
         except Error as e:
             print(f"Error in execution:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             raise
         finally:
-            conn.close()
+            self.release_connection(conn)
+
+        if cached:
+            result = copy_result(result)
+            self.cache.set(key, tables, result, versions)
+            return copy_result(result)
+        return result
+
+    def execute_many_queries(self, queries):
+        # Sends independent read queries in one round trip and returns {name: rows} for {name: (query, params)}.
+        # Each query becomes a json_agg subquery of a single SELECT. Its values travel in their text form and go
+        # through psycopg2's own typecasters, so the rows hold the same types as those of a plain query.
+        if not queries:
+            return {}
+
+        conn = self.get_connection()
+        if conn is None:
+            raise ConnectionError("Failed to connect to Database.")
+
+        try:
+            with conn.cursor() as cur:
+                shapes = {name: self._query_columns(cur, query, query_params)
+                          for name, (query, query_params) in queries.items()}
+
+                columns = []
+                params = []
+                for name, (query, query_params) in queries.items():
+                    values = ", ".join(f'q."{column}"::text' for column, _ in shapes[name])
+                    columns.append(f'(SELECT COALESCE(json_agg(json_build_array({values})), \'[]\') FROM ({query}) q) AS "{name}"')
+                    params.extend(query_params or ())
+
+                cur.execute(f"SELECT {', '.join(columns)}", params)
+                result = cur.fetchone()
+
+                return {
+                    name: [self._cast_row(cur, shapes[name], values) for values in result[name]]
+                    for name in queries
+                }
+
+        except Error as e:
+            print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
+            return None
+        finally:
+            self.release_connection(conn)
+
+    def _query_columns(self, cur, query, params):
+        # (name, type oid) of each column the query returns. Looked up once per query text, without reading rows.
+        columns = self._query_shapes.get(query)
+        if columns is None:
+            cur.execute(f"SELECT * FROM ({query}) q LIMIT 0", params)
+            columns = [(column.name, column.type_code) for column in cur.description]
+            self._query_shapes[query] = columns
+        return columns
+
+    @staticmethod
+    def _cast_row(cur, columns, values):
+        row = {}
+        for (name, type_code), value in zip(columns, values):
+            cast = extensions.string_types.get(type_code)
+            row[name] = cast(value, cur) if cast is not None and value is not None else value
+        return row
+
+    def stream(self, query, params=None, batch_size=BULK_PAGE_SIZE):
+        # Yields rows of a server-side cursor batch by batch, so only one batch is ever held in memory.
+        # The cursor lives on its own pooled connection: a streamed response body is still being produced
+        # after the request's unit of work has been committed and its connection returned.
+        conn = self.pool.getconn()
+
+        try:
+            with conn.cursor(name="stream") as cur:
+                cur.itersize = batch_size
+                cur.execute(query, params)
+
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+
+        except Error as e:
+            print(f"Error streaming rows:\n{e}")
+            raise
+        finally:
+            # Also runs when the client disconnects and the generator is closed half way. putconn() rolls back,
+            # and closes a connection the server dropped instead of raising before the slot is given back.
+            self.pool.putconn(conn)
 
     def init_db(self):
         conn = self.get_connection()
@@ -129,159 +795,840 @@ class Database:
                     );
                 """)
 
-                conn.commit()
+                # Exact row counts kept up to date by statement-level triggers, so totals never need a COUNT(*) scan.
+                # Like table_versions, a table's count is the sum of its slots, and a writer adds its rows to any
+                # slot no other transaction holds. A single slot can go negative, only the sum is a row count.
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS table_counts (
+                        table_name varchar NOT NULL,
+                        slot bigint NOT NULL DEFAULT 0,
+                        row_count bigint NOT NULL DEFAULT 0,
+                        PRIMARY KEY (table_name, slot)
+                    );
+
+                    CREATE SEQUENCE IF NOT EXISTS table_counts_slot_seq;
+                """)
+
+                # Before slots, a table had exactly one row, keyed by its name alone
+                if "slot" in self._missing_columns(cur, "table_counts", ["slot"]):
+                    cur.execute("""
+                        ALTER TABLE table_counts
+                            DROP CONSTRAINT IF EXISTS table_counts_row_count_check,
+                            ADD COLUMN slot bigint NOT NULL DEFAULT 0,
+                            DROP CONSTRAINT table_counts_pkey,
+                            ADD PRIMARY KEY (table_name, slot);
+                    """)
+
+                cur.execute("""
+                    CREATE OR REPLACE FUNCTION update_table_count() RETURNS trigger AS $$
+                    DECLARE
+                        delta bigint;
+                    BEGIN
+                        -- TRUNCATE holds the table exclusively, so no writer of it can be holding a slot
+                        IF TG_OP = 'TRUNCATE' THEN
+                            UPDATE table_counts SET row_count = 0 WHERE table_name = TG_TABLE_NAME;
+                            RETURN NULL;
+                        ELSIF TG_OP = 'INSERT' THEN
+                            SELECT count(*) INTO delta FROM new_rows;
+                        ELSE
+                            SELECT -count(*) INTO delta FROM old_rows;
+                        END IF;
+
+                        IF delta <> 0 THEN
+                            UPDATE table_counts SET row_count = row_count + delta
+                            WHERE (table_name, slot) = (
+                                SELECT table_name, slot FROM table_counts
+                                WHERE table_name = TG_TABLE_NAME
+                                LIMIT 1
+                                FOR UPDATE SKIP LOCKED
+                            );
+                            IF NOT FOUND THEN
+                                INSERT INTO table_counts (table_name, slot, row_count)
+                                VALUES (TG_TABLE_NAME, nextval('table_counts_slot_seq'), delta);
+                            END IF;
+                        END IF;
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql;
+                """)
+
+                for table in COUNTED_TABLES:
+                    cur.execute(f"""
+                        CREATE OR REPLACE TRIGGER {table}_count_insert
+                        AFTER INSERT ON {table}
+                        REFERENCING NEW TABLE AS new_rows
+                        FOR EACH STATEMENT EXECUTE FUNCTION update_table_count();
+
+                        CREATE OR REPLACE TRIGGER {table}_count_delete
+                        AFTER DELETE ON {table}
+                        REFERENCING OLD TABLE AS old_rows
+                        FOR EACH STATEMENT EXECUTE FUNCTION update_table_count();
+
+                        CREATE OR REPLACE TRIGGER {table}_count_truncate
+                        AFTER TRUNCATE ON {table}
+                        FOR EACH STATEMENT EXECUTE FUNCTION update_table_count();
+
+                        INSERT INTO table_counts (table_name, row_count)
+                        SELECT '{table}', (SELECT count(*) FROM {table})
+                        WHERE NOT EXISTS (SELECT 1 FROM table_counts WHERE table_name = '{table}');
+                    """)
+
+                # A change counter per table, bumped once per writing statement. It becomes visible with the
+                # write's commit, so a version read before a query is never newer than the data it returns.
+                # The NOTIFY is delivered on commit too, and only once per table however many statements ran.
+                # A table's version is the sum of its slots. A writer bumps any slot no other transaction holds
+                # and adds a slot when all are taken, so writers never wait on each other's counter (or deadlock
+                # over two tables' counters), and there are only as many slots as concurrent writers ever were.
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS table_versions (
+                        table_name varchar NOT NULL,
+                        slot bigint NOT NULL DEFAULT 0,
+                        version bigint NOT NULL DEFAULT 0,
+                        PRIMARY KEY (table_name, slot)
+                    );
+
+                    CREATE SEQUENCE IF NOT EXISTS table_versions_slot_seq;
+                """)
+
+                # Before slots, a table had exactly one row, keyed by its name alone
+                if "slot" in self._missing_columns(cur, "table_versions", ["slot"]):
+                    cur.execute("""
+                        ALTER TABLE table_versions
+                            ADD COLUMN slot bigint NOT NULL DEFAULT 0,
+                            DROP CONSTRAINT table_versions_pkey,
+                            ADD PRIMARY KEY (table_name, slot);
+                    """)
+
+                cur.execute(f"""
+                    CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+                    BEGIN
+                        UPDATE table_versions SET version = version + 1
+                        WHERE (table_name, slot) = (
+                            SELECT table_name, slot FROM table_versions
+                            WHERE table_name = TG_TABLE_NAME
+                            LIMIT 1
+                            FOR UPDATE SKIP LOCKED
+                        );
+                        IF NOT FOUND THEN
+                            INSERT INTO table_versions (table_name, slot, version)
+                            VALUES (TG_TABLE_NAME, nextval('table_versions_slot_seq'), 1);
+                        END IF;
+                        PERFORM pg_notify('{CHANGE_CHANNEL}', TG_TABLE_NAME);
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql;
+                """)
+
+                for table in VERSIONED_TABLES:
+                    cur.execute(f"""
+                        CREATE OR REPLACE TRIGGER {table}_version
+                        AFTER INSERT OR UPDATE OR DELETE ON {table}
+                        FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+                        CREATE OR REPLACE TRIGGER {table}_version_truncate
+                        AFTER TRUNCATE ON {table}
+                        FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+                        INSERT INTO table_versions (table_name) VALUES ('{table}')
+                        ON CONFLICT (table_name, slot) DO NOTHING;
+                    """)
+
+                # Change tracking for get_changes(). row_version is the id of the transaction that last wrote
+                # the row; deletes and key changes leave the old key behind in deleted_rows. Adding the columns
+                # rewrites each table once, stamping the existing rows with this transaction.
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS deleted_rows (
+                        deleted_id bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+                        table_name varchar NOT NULL,
+                        row_key jsonb,
+                        deleted_at timestamptz NOT NULL DEFAULT now(),
+                        row_version xid8 NOT NULL DEFAULT pg_current_xact_id()
+                    );
+
+                    CREATE OR REPLACE FUNCTION row_key(row_data jsonb, key_columns text[]) RETURNS jsonb AS $$
+                        SELECT jsonb_object_agg(key_column, row_data -> key_column) FROM unnest(key_columns) AS key_column;
+                    $$ LANGUAGE sql IMMUTABLE;
+
+                    CREATE OR REPLACE FUNCTION stamp_row_version() RETURNS trigger AS $$
+                    BEGIN
+                        NEW.updated_at := now();
+                        NEW.row_version := pg_current_xact_id();
+                        RETURN NEW;
+                    END;
+                    $$ LANGUAGE plpgsql;
+
+                    -- The trigger arguments are the table's key columns. A truncate leaves a NULL key,
+                    -- which tells clients to sync the table from scratch.
+                    CREATE OR REPLACE FUNCTION record_deleted_rows() RETURNS trigger AS $$
+                    BEGIN
+                        IF TG_OP = 'TRUNCATE' THEN
+                            INSERT INTO deleted_rows (table_name, row_key) VALUES (TG_TABLE_NAME, NULL);
+                        ELSIF TG_OP = 'DELETE' THEN
+                            INSERT INTO deleted_rows (table_name, row_key)
+                            SELECT TG_TABLE_NAME, row_key(to_jsonb(o), TG_ARGV) FROM old_rows o;
+                        ELSE
+                            INSERT INTO deleted_rows (table_name, row_key)
+                            SELECT TG_TABLE_NAME, changed.row_key FROM (
+                                SELECT row_key(to_jsonb(o), TG_ARGV) FROM old_rows o
+                                EXCEPT
+                                SELECT row_key(to_jsonb(n), TG_ARGV) FROM new_rows n
+                            ) changed;
+                        END IF;
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql;
+                """)
+
+                column_types = {
+                    "updated_at": "timestamptz NOT NULL DEFAULT now()",
+                    "row_version": "xid8 NOT NULL DEFAULT pg_current_xact_id()",
+                }
+                for table, (keys, _) in CHANGE_SOURCES.items():
+                    # ALTER TABLE locks the table out even when there is nothing to add, so only missing columns
+                    # are added. Without statistics on a new row_version the planner can't tell a sync reads
+                    # only a few rows, and analyzing is only needed then.
+                    missing = self._missing_columns(cur, table, CHANGE_COLUMNS)
+                    if missing:
+                        cur.execute(f"""
+                            ALTER TABLE {table}
+                            {", ".join(f"ADD COLUMN {column} {column_types[column]}" for column in missing)};
+
+                            ANALYZE {table};
+                        """)
+
+                    key_args = ", ".join(f"'{key}'" for key in keys)
+                    cur.execute(f"""
+                        CREATE OR REPLACE TRIGGER {table}_stamp
+                        BEFORE UPDATE ON {table}
+                        FOR EACH ROW EXECUTE FUNCTION stamp_row_version();
+
+                        CREATE OR REPLACE TRIGGER {table}_tombstone_delete
+                        AFTER DELETE ON {table}
+                        REFERENCING OLD TABLE AS old_rows
+                        FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows({key_args});
+
+                        CREATE OR REPLACE TRIGGER {table}_tombstone_truncate
+                        AFTER TRUNCATE ON {table}
+                        FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows({key_args});
+                    """)
+
+                # Replacing a match fighter updates the participants key in place
+                cur.execute("""
+                    CREATE OR REPLACE TRIGGER participants_tombstone_update
+                    AFTER UPDATE ON participants
+                    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                    FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows('match_id', 'fighter_id');
+                """)
+
+                # Win/loss/draw counters follow the participants table. Each statement's changes are summed per fighter
+                # and applied as relative updates under row locks, so concurrent match writes can't lose an update.
+                cur.execute("""
+                    CREATE OR REPLACE FUNCTION update_fighter_records() RETURNS trigger AS $$
+                    BEGIN
+                        -- Lock every affected record in fighter_id order first, so two match writes touching
+                        -- the same fighters in a different order wait for each other instead of deadlocking
+                        IF TG_OP = 'INSERT' THEN
+                            PERFORM 1 FROM fighter_records
+                            WHERE fighter_id IN (SELECT fighter_id FROM new_rows)
+                            ORDER BY fighter_id FOR UPDATE;
+                        ELSIF TG_OP = 'DELETE' THEN
+                            PERFORM 1 FROM fighter_records
+                            WHERE fighter_id IN (SELECT fighter_id FROM old_rows)
+                            ORDER BY fighter_id FOR UPDATE;
+                        ELSE
+                            PERFORM 1 FROM fighter_records
+                            WHERE fighter_id IN (SELECT fighter_id FROM old_rows UNION SELECT fighter_id FROM new_rows)
+                            ORDER BY fighter_id FOR UPDATE;
+                        END IF;
+
+                        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                            UPDATE fighter_records fr
+                            SET wins = fr.wins - o.wins, losses = fr.losses - o.losses, draws = fr.draws - o.draws
+                            FROM (
+                                SELECT fighter_id,
+                                       count(*) FILTER (WHERE result = 'win') AS wins,
+                                       count(*) FILTER (WHERE result = 'loss') AS losses,
+                                       count(*) FILTER (WHERE result = 'draw') AS draws
+                                FROM old_rows
+                                WHERE result IN ('win', 'loss', 'draw')
+                                GROUP BY fighter_id
+                            ) o
+                            WHERE fr.fighter_id = o.fighter_id;
+                        END IF;
+
+                        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                            INSERT INTO fighter_records AS fr (fighter_id, wins, losses, draws)
+                            SELECT fighter_id,
+                                   count(*) FILTER (WHERE result = 'win'),
+                                   count(*) FILTER (WHERE result = 'loss'),
+                                   count(*) FILTER (WHERE result = 'draw')
+                            FROM new_rows
+                            WHERE result IN ('win', 'loss', 'draw')
+                            GROUP BY fighter_id
+                            ORDER BY fighter_id
+                            ON CONFLICT (fighter_id) DO UPDATE
+                            SET wins = fr.wins + EXCLUDED.wins,
+                                losses = fr.losses + EXCLUDED.losses,
+                                draws = fr.draws + EXCLUDED.draws;
+                        END IF;
+
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql;
+
+                    CREATE OR REPLACE TRIGGER participants_records_insert
+                    AFTER INSERT ON participants
+                    REFERENCING NEW TABLE AS new_rows
+                    FOR EACH STATEMENT EXECUTE FUNCTION update_fighter_records();
+
+                    CREATE OR REPLACE TRIGGER participants_records_update
+                    AFTER UPDATE ON participants
+                    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                    FOR EACH STATEMENT EXECUTE FUNCTION update_fighter_records();
+
+                    CREATE OR REPLACE TRIGGER participants_records_delete
+                    AFTER DELETE ON participants
+                    REFERENCING OLD TABLE AS old_rows
+                    FOR EACH STATEMENT EXECUTE FUNCTION update_fighter_records();
+                """)
+
+                # Match writes run server side, one call per operation. Invalid input is raised as
+                # invalid_parameter_value, which the Python wrappers turn back into ValueError.
+                cur.execute("""
+                    CREATE OR REPLACE FUNCTION match_result(fighter_id integer, opponent_id integer, winner_id integer)
+                    RETURNS varchar AS $$
+                        SELECT CASE
+                            WHEN winner_id = fighter_id THEN 'win'
+                            WHEN winner_id = opponent_id THEN 'loss'
+                            WHEN winner_id = 0 THEN 'draw'
+                            ELSE 'no contest'
+                        END;
+                    $$ LANGUAGE sql IMMUTABLE;
+
+                    -- Why a new match is invalid, or NULL if it isn't. Shared by create_match() and the batch check
+                    -- of create_matches_bulk(). A winner of 0 is a draw, and -1 or NULL no contest.
+                    CREATE OR REPLACE FUNCTION match_error(p_start_date timestamp, p_end_date timestamp,
+                                                           p_fighter1_id integer, p_fighter2_id integer, p_winner_id integer)
+                    RETURNS varchar AS $$
+                        SELECT CASE
+                            WHEN p_end_date IS NULL THEN 'End Date is required.'
+                            WHEN p_end_date < p_start_date THEN 'End Date can''t be earlier than Start Date.'
+                            WHEN p_fighter1_id = p_fighter2_id THEN 'Fighters can''t fight themselves.'
+                            WHEN p_winner_id NOT IN (0, -1, p_fighter1_id, p_fighter2_id)
+                                THEN 'The winner has to be one of the match''s fighters.'
+                        END;
+                    $$ LANGUAGE sql IMMUTABLE;
+
+                    CREATE OR REPLACE FUNCTION create_match(p_start_date timestamp, p_end_date timestamp, p_location varchar,
+                                                            p_fighter1_id integer, p_fighter2_id integer, p_winner_id integer)
+                    RETURNS integer AS $$
+                    DECLARE
+                        new_match_id integer;
+                        problem varchar := match_error(p_start_date, p_end_date, p_fighter1_id, p_fighter2_id, p_winner_id);
+                    BEGIN
+                        IF problem IS NOT NULL THEN
+                            RAISE EXCEPTION '%', problem
+                                USING ERRCODE = 'invalid_parameter_value';
+                        END IF;
+
+                        INSERT INTO match_events (start_date, end_date, location)
+                        VALUES (p_start_date, p_end_date, p_location)
+                        RETURNING match_id INTO new_match_id;
+
+                        INSERT INTO participants (match_id, fighter_id, result)
+                        VALUES (new_match_id, p_fighter1_id, match_result(p_fighter1_id, p_fighter2_id, p_winner_id)),
+                               (new_match_id, p_fighter2_id, match_result(p_fighter2_id, p_fighter1_id, p_winner_id));
+
+                        RETURN new_match_id;
+                    END;
+                    $$ LANGUAGE plpgsql;
+
+                    CREATE OR REPLACE FUNCTION update_match_result(p_match_id integer, p_winner_id integer)
+                    RETURNS boolean AS $$
+                    BEGIN
+                        UPDATE participants p
+                        SET result = match_result(p.fighter_id, o.fighter_id, p_winner_id)
+                        FROM participants o
+                        WHERE p.match_id = p_match_id AND o.match_id = p_match_id AND o.fighter_id <> p.fighter_id;
+
+                        IF NOT FOUND THEN
+                            RAISE EXCEPTION 'Match with ID: % has no fighters to score.', p_match_id
+                                USING ERRCODE = 'invalid_parameter_value';
+                        END IF;
+
+                        RETURN true;
+                    END;
+                    $$ LANGUAGE plpgsql;
+
+                    CREATE OR REPLACE FUNCTION update_match_player(p_match_id integer, p_old_fighter_id integer, p_new_fighter_id integer)
+                    RETURNS boolean AS $$
+                    BEGIN
+                        IF EXISTS (SELECT 1 FROM participants WHERE match_id = p_match_id AND fighter_id = p_new_fighter_id) THEN
+                            RAISE EXCEPTION 'Fighter with ID % is already a participant in this match.', p_new_fighter_id
+                                USING ERRCODE = 'invalid_parameter_value';
+                        END IF;
+
+                        UPDATE participants
+                        SET fighter_id = p_new_fighter_id
+                        WHERE match_id = p_match_id AND fighter_id = p_old_fighter_id;
+
+                        IF NOT FOUND THEN
+                            RAISE EXCEPTION 'Fighter with ID: % did not participate in this match.', p_old_fighter_id
+                                USING ERRCODE = 'invalid_parameter_value';
+                        END IF;
+
+                        RETURN true;
+                    END;
+                    $$ LANGUAGE plpgsql;
+                """)
+
+                # Trigram indexes let the '%term%' searches use an index instead of scanning the table
+                cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+
+                for table, vector in SEARCH_VECTORS.items():
+                    cur.execute(f"""
+                        ALTER TABLE {table}
+                        ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ({vector}) STORED;
+                    """)
+
+                self._commit(conn, TABLES)
                 print("Database schema initialized successfully.")
 
         except Error as e:
             print(f"Error initializing database:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             raise
         finally:
-            if conn:
-                conn.close()
+            self.release_connection(conn)
 
-    def get_all_gyms(self, limit=100):
-        conn = self.get_connection()
-        if conn is None:
-            raise ConnectionError("Failed to connect to Database.")
+        self.ensure_indexes()
+
+    def ensure_indexes(self):
+        # Runs on its own autocommit connection: CREATE INDEX CONCURRENTLY cannot run inside a transaction,
+        # and must not wait on a unit of work that holds locks on the same tables
+        conn = self.pool.getconn()
+        conn.autocommit = True
 
         try:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT gym_id, name, location, owner, reputation_score
-                    FROM gyms
-                    ORDER BY gym_id DESC
-                    LIMIT %s        
-                """, (limit,))
+                for name in RETIRED_INDEXES:
+                    cur.execute("SELECT to_regclass(%s) IS NOT NULL AS found", (name,))
+                    if cur.fetchone()["found"]:
+                        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                        print(f"Dropped retired index {name}")
 
-                return cur.fetchall()
+                for name, table, definition in INDEXES:
+                    cur.execute("""
+                        SELECT i.indisvalid
+                        FROM pg_index i
+                        JOIN pg_class c ON c.oid = i.indexrelid
+                        WHERE c.relname = %s AND c.relnamespace = current_schema()::regnamespace
+                    """, (name,))
+                    index = cur.fetchone()
+
+                    if index and index["indisvalid"]:
+                        continue
+                    if index:
+                        # Left behind by an interrupted concurrent build
+                        print(f"Rebuilding invalid index {name}")
+                        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+                    # Only a table that already holds data is worth building without blocking writes
+                    cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table}) AS has_rows")
+                    concurrently = "CONCURRENTLY" if cur.fetchone()["has_rows"] else ""
+                    cur.execute(f"CREATE INDEX {concurrently} IF NOT EXISTS {name} ON {table} {definition}")
+                    print(f"Created index {name}")
+
+        except Error as e:
+            print(f"Error creating indexes:\n{e}")
+            raise
+        finally:
+            # A connection that broke can't be switched back, so it is closed instead of returned
+            try:
+                conn.autocommit = False
+            except Error:
+                self.pool.putconn(conn, close=True)
+            else:
+                self.pool.putconn(conn)
+
+    def find_unindexed_queries(self):
+        # Names of HOT_QUERIES that still read a whole table when the planner is told to avoid sequential scans.
+        # A btree scan only narrows the search when the condition is on its leading column, so a scan that
+        # filters on a later column (e.g. trainer_id in fighter_trainer's unique key) counts as a full scan too.
+        conn = self.pool.getconn()
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL enable_seqscan = off")
+                unindexed = []
+                for name, (query, params) in HOT_QUERIES.items():
+                    cur.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+                    plans = [cur.fetchone()["QUERY PLAN"][0]["Plan"]]
+                    while plans:
+                        plan = plans.pop()
+                        if plan["Node Type"] == "Seq Scan" or ("Index Name" in plan and not self._uses_leading_column(cur, plan)):
+                            unindexed.append(name)
+                            break
+                        plans.extend(plan.get("Plans", []))
+                return unindexed
+
+        except Error as e:
+            print(f"Error checking query plans:\n{e}")
+            return None
+        finally:
+            # Rolls back the SET LOCAL too
+            self.pool.putconn(conn)
+
+    def _missing_columns(self, cur, table, columns):
+        # The columns the table doesn't have yet, checked up front so init_db only alters what it has to
+        cur.execute("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s AND column_name = ANY(%s)
+        """, (table, list(columns)))
+        existing = {row["column_name"] for row in cur.fetchall()}
+        return [column for column in columns if column not in existing]
+
+    def _uses_leading_column(self, cur, plan):
+        cur.execute("""
+            SELECT a.attname
+            FROM pg_index i
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+            WHERE i.indexrelid = %s::regclass
+        """, (plan["Index Name"],))
+        leading = cur.fetchone()
+
+        # Expression and GIN indexes have no plain leading column to check
+        return leading is None or leading["attname"] in plan.get("Index Cond", "")
+
+    def get_all_gyms(self, limit=100, include_counts=False, include_members=False, cursor=None, fields=None):
+        after, after_params = keyset_condition(["g.gym_id"], cursor)
+        columns = gym_columns(include_counts, include_members, fields)
+        # Gyms change rarely, so pages are cached; counts and member lists also depend on fighters and trainers
+        tables = ("gyms", "fighters", "trainers") if include_counts or include_members else ("gyms",)
+
+        try:
+            rows = self.execute(f"""
+                SELECT {columns}
+                FROM gyms g
+                WHERE {after}
+                ORDER BY g.gym_id DESC
+                LIMIT %s        
+            """, (*after_params, limit + 1), fetch=True, tables=tables)
+
+            return keyset_page(rows, limit, ["gym_id"])
             
         except Error as e:
             print(f"Error fetching information:\n{e}")
             return None
-        finally:
-            conn.close()
 
-    def get_all_fighters(self, limit=100):
+    def get_all_fighters(self, limit=100, include_details=False, cursor=None, fields=None, filters=None):
+        after, after_params = keyset_condition(["f.fighter_id"], cursor)
+        columns, joins = fighter_columns(include_details, fields)
+        where, where_params = filter_condition(FIGHTER_FILTERS, filters)
+
         conn = self.get_connection()
         if conn is None:
             raise ConnectionError("Failed to connect to Database.")
-        
+
         try:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT fighter_id, name, nickname, weight_class, height, age, nationality, status, gym_id
-                    FROM fighters
-                    ORDER BY fighter_id DESC
+                cur.execute(f"""
+                    SELECT {columns}
+                    FROM fighters f
+                    {joins}
+                    WHERE {where} AND {after}
+                    ORDER BY f.fighter_id DESC
                     LIMIT %s
-                """, (limit,))
+                """, (*where_params, *after_params, limit + 1))
 
-                return cur.fetchall()
+                return keyset_page(cur.fetchall(), limit, ["fighter_id"])
 
         except Error as e:
             print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
+
+    def get_all_trainers(self, limit=100, include_details=False, cursor=None, fields=None, filters=None):
+        after, after_params = keyset_condition(["t.trainer_id"], cursor)
+        columns, joins = trainer_columns(include_details, fields)
+        where, where_params = filter_condition(TRAINER_FILTERS, filters)
 
-    def get_all_trainers(self, limit=100):
         conn = self.get_connection()
         if conn is None:
             raise ConnectionError("Failed to connect to Database.")
-        
+
         try:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT trainer_id, name, specialty, gym_id
-                    FROM trainers
-                    ORDER BY trainer_id DESC
+                cur.execute(f"""
+                    SELECT {columns}
+                    FROM trainers t
+                    {joins}
+                    WHERE {where} AND {after}
+                    ORDER BY t.trainer_id DESC
                     LIMIT %s
-                """, (limit,))
+                """, (*where_params, *after_params, limit + 1))
 
-                return cur.fetchall()
+                return keyset_page(cur.fetchall(), limit, ["trainer_id"])
 
         except Error as e:
             print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
+
+    def get_all_matches(self, limit=100, cursor=None, fields=None):
+        after, after_params = keyset_condition(["m.match_id"], cursor)
+        columns = select_fields(MATCH_LIST_FIELDS, fields, ["match_id"])
 
-    def get_all_matches(self, limit=100):
         conn = self.get_connection()
         if conn is None:
             raise ConnectionError("Failed to connect to Database.")
-        
+
         try:
             with conn.cursor() as cur:
-                # Use EXTRACT to get duration as a string instead of interval
-                cur.execute("""
-                    SELECT 
-                        match_id, 
-                        start_date, 
-                        end_date, 
-                        EXTRACT(EPOCH FROM (end_date - start_date)) as duration_seconds,
-                        location
-                    FROM match_events
-                    ORDER BY match_id DESC
+                cur.execute(f"""
+                    SELECT {columns}
+                    FROM match_events m
+                    {MATCH_LIST_JOINS}
+                    WHERE {after}
+                    ORDER BY m.match_id DESC
                     LIMIT %s
-                """, (limit,))
-                
-                matches = cur.fetchall()
-                
-                # Convert duration from seconds to string format
-                for match in matches:
-                    if match['duration_seconds']:
-                        # Convert seconds to HH:MM:SS format
-                        total_seconds = int(match['duration_seconds'])
-                        hours = total_seconds // 3600
-                        minutes = (total_seconds % 3600) // 60
-                        seconds = total_seconds % 60
-                        match['duration'] = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                    else:
-                        match['duration'] = None
-                
-                result = []
-                for match in matches:
-                    match_id = match['match_id']
-                    fighter_details = self.get_match_fighters(match_id)
-                    if fighter_details:
-                        match_dict = dict(match)
-                        match_dict.update(fighter_details)
-                        result.append(match_dict)
+                """, (*after_params, limit + 1))
                 
+                result = keyset_page(cur.fetchall(), limit, ["match_id"])
                 print(f"DEBUG: Fetched {len(result)} matches from database")
                 return result
 
         except Error as e:
             print(f"Error fetching matches:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
-
-    def get_gym(self, field="gym_id", value=1):
+            self.release_connection(conn)
+
+    def stream_gyms(self, include_counts=False, include_members=False, fields=None):
+        # Same rows and order as paging through get_all_gyms, as one stream
+        return self.stream(f"""
+            SELECT {gym_columns(include_counts, include_members, fields)}
+            FROM gyms g
+            ORDER BY g.gym_id DESC
+        """)
+
+    def stream_fighters(self, include_details=False, fields=None, filters=None):
+        columns, joins = fighter_columns(include_details, fields)
+        where, where_params = filter_condition(FIGHTER_FILTERS, filters)
+        return self.stream(f"""
+            SELECT {columns}
+            FROM fighters f
+            {joins}
+            WHERE {where}
+            ORDER BY f.fighter_id DESC
+        """, where_params)
+
+    def stream_trainers(self, include_details=False, fields=None, filters=None):
+        columns, joins = trainer_columns(include_details, fields)
+        where, where_params = filter_condition(TRAINER_FILTERS, filters)
+        return self.stream(f"""
+            SELECT {columns}
+            FROM trainers t
+            {joins}
+            WHERE {where}
+            ORDER BY t.trainer_id DESC
+        """, where_params)
+
+    def stream_matches(self, fields=None):
+        return self.stream(f"""
+            SELECT {select_fields(MATCH_LIST_FIELDS, fields, ["match_id"])}
+            FROM match_events m
+            {MATCH_LIST_JOINS}
+            ORDER BY m.match_id DESC
+        """)
+
+    def get_match(self, match_id):
         conn = self.get_connection()
         if conn is None:
             raise ConnectionError("Failed to connect to Database.")
         
-        valid_fields = ["gym_id", "name", "location", "owner", "reputation_score"]
-        if field not in valid_fields:
-            raise ValueError(f"Invalid field name: {field}")
-
         try:
             with conn.cursor() as cur:
                 cur.execute(f"""
-                    SELECT gym_id, name, location, owner, reputation_score
-                    FROM gyms
-                    WHERE {field} = %s
-                """, (value,))
+                    {MATCH_LIST_SELECT}
+                    WHERE m.match_id = %s
+                """, (match_id,))
 
                 return cur.fetchone()
 
         except Error as e:
-            print(f"Error fetching information:\n{e}")
+            print(f"Error fetching match:\n{e}")
+            self._rollback(conn)
+            return None
+        finally:
+            self.release_connection(conn)
+
+    def get_table_counts(self, mode="exact"):
+        if mode == "exact":
+            query = """
+                SELECT table_name, sum(row_count)::bigint AS row_count
+                FROM table_counts
+                WHERE table_name = ANY(%s)
+                GROUP BY table_name
+            """
+        elif mode == "approximate":
+            # reltuples is the planner's estimate from the last VACUUM/ANALYZE, -1 if never analyzed
+            query = """
+                SELECT relname AS table_name, GREATEST(reltuples, 0)::bigint AS row_count
+                FROM pg_class
+                WHERE oid = ANY(%s::regclass[])
+            """
+        else:
+            raise ValueError(f"Invalid count mode: {mode}")
+
+        # Approximate counts only move with ANALYZE, so those are tagged with the counted tables and mostly age out
+        tables = ("table_counts",) if mode == "exact" else tuple(COUNTED_TABLES)
+
+        try:
+            rows = self.execute(query, (list(COUNTED_TABLES),), fetch=True, tables=tables)
+
+            counts = {name: 0 for name in COUNTED_TABLES.values()}
+            for row in rows:
+                counts[COUNTED_TABLES[row["table_name"]]] = row["row_count"]
+            return counts
+
+        except Error as e:
+            print(f"Error fetching counts:\n{e}")
+            return None
+
+    def get_table_count(self, table, mode="exact"):
+        counts = self.get_table_counts(mode)
+        return counts.get(COUNTED_TABLES.get(table, table)) if counts else None
+
+    def get_table_versions(self, tables):
+        # Current change counters of the tables, in the given order. Never cached: other workers' writes
+        # only show up here.
+        conn = self.get_connection()
+        if conn is None:
+            raise ConnectionError("Failed to connect to Database.")
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT table_name, sum(version)::bigint AS version
+                    FROM table_versions
+                    WHERE table_name = ANY(%s)
+                    GROUP BY table_name
+                """, (list(tables),))
+
+                versions = {row["table_name"]: row["version"] for row in cur.fetchall()}
+                return [versions.get(table, 0) for table in tables]
+
+        except Error as e:
+            print(f"Error fetching table versions:\n{e}")
+            self._rollback(conn)
+            return None
+        finally:
+            self.release_connection(conn)
+
+    def get_changes(self, token=None, limit=500, tables=None):
+        # Rows written and keys deleted since the token, up to limit rows per table and limit tombstones.
+        # Returns (changes, next token, more); with more set, the next token continues the same batch.
+        #
+        # A token is (since, until, positions). Transactions below the snapshot xmin taken on the first
+        # page had all finished by then, so the last page hands out until = that xmin as the next since.
+        # Writes committed later carry a higher transaction id and are picked up by the next sync, at the
+        # price of sometimes sending a row twice. Clients apply both lists in row_version order.
+        tables = list(CHANGE_SOURCES) if tables is None else tables
+        invalid = [table for table in tables if table not in CHANGE_SOURCES]
+        if invalid:
+            raise ValueError(f"Invalid tables: {', '.join(invalid)}")
+
+        since, until, positions = decode_cursor(token, 3) if token else (None, None, {})
+        if not isinstance(positions, dict):
+            raise ValueError("Invalid cursor.")
+
+        conn = self.get_connection()
+        if conn is None:
+            raise ConnectionError("Failed to connect to Database.")
+
+        try:
+            with conn.cursor() as cur:
+                if until is None:
+                    cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS xmin")
+                    until = cur.fetchone()["xmin"]
+
+                changes = {table: {"upserted": [], "deleted": []} for table in tables}
+                more = False
+
+                for table in tables:
+                    keys, columns = CHANGE_SOURCES[table]
+                    where, params = change_condition(since, positions.get(table), keys)
+                    # Sorting by the bare name would pick the text output column and sort the whole table
+                    cur.execute(f"""
+                        SELECT {columns}, updated_at, row_version::text AS row_version
+                        FROM {table}
+                        WHERE {where}
+                        ORDER BY {table}.row_version, {', '.join(keys)}
+                        LIMIT %s
+                    """, (*params, limit + 1))
+
+                    rows = cur.fetchall()
+                    if len(rows) > limit:
+                        more = True
+                        rows = rows[:limit]
+                    if rows:
+                        positions[table] = [rows[-1]["row_version"], *(rows[-1][key] for key in keys)]
+                    changes[table]["upserted"] = rows
+
+                # A full sync has nothing to delete yet: rows gone during it are deleted at or after until
+                if since is not None:
+                    where, params = change_condition(since, positions.get("deleted_rows"), ["deleted_id"])
+                    cur.execute(f"""
+                        SELECT deleted_id, table_name, row_key, deleted_at, row_version::text AS row_version
+                        FROM deleted_rows
+                        WHERE table_name = ANY(%s) AND {where}
+                        ORDER BY deleted_rows.row_version, deleted_id
+                        LIMIT %s
+                    """, (tables, *params, limit + 1))
+
+                    rows = cur.fetchall()
+                    if len(rows) > limit:
+                        more = True
+                        rows = rows[:limit]
+                    if rows:
+                        positions["deleted_rows"] = [rows[-1]["row_version"], rows[-1]["deleted_id"]]
+                    for row in rows:
+                        changes[row["table_name"]]["deleted"].append(
+                            {"key": row["row_key"], "deleted_at": row["deleted_at"], "row_version": row["row_version"]}
+                        )
+
+                next_token = encode_cursor([since, until, positions] if more else [until, None, {}])
+                return changes, next_token, more
+
+        except Error as e:
+            print(f"Error fetching changes:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
+
+    def get_gym(self, field="gym_id", value=1):
+        valid_fields = ["gym_id", "name", "location", "owner", "reputation_score"]
+        if field not in valid_fields:
+            raise ValueError(f"Invalid field name: {field}")
+
+        try:
+            return self.execute(f"""
+                SELECT gym_id, name, location, owner, reputation_score
+                FROM gyms
+                WHERE {field} = %s
+            """, (value,), fetchone=True, tables=("gyms",))
+
+        except Error as e:
+            print(f"Error fetching information:\n{e}")
+            return None
     
     def get_gym_by_reputation(self, min_score=0, max_score=100):
         conn = self.get_connection()
@@ -301,30 +1648,33 @@ class Database:
 
         except Error as e:
             print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
     
-    def get_gym_fighters(self, gym_id):
+    def get_gym_fighters(self, gym_id, include_details=False):
         conn = self.get_connection()
         if conn is None:
             raise ConnectionError("Failed to connect to Database.")
         
         try:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT fighter_id, name, nickname, weight_class, height, age, nationality, status, gym_id
-                    FROM fighters
-                    WHERE gym_id = %s
+                cur.execute(f"""
+                    SELECT {FIGHTER_DETAIL_COLUMNS if include_details else FIGHTER_COLUMNS}
+                    FROM fighters f
+                    {FIGHTER_DETAIL_JOINS if include_details else ""}
+                    WHERE f.gym_id = %s
                 """, (gym_id,))
 
                 return cur.fetchall()
 
         except Error as e:
             print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def get_gym_trainers(self, gym_id):
         conn = self.get_connection()
@@ -343,9 +1693,27 @@ class Database:
 
         except Error as e:
             print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
+
+    def get_gym_details(self, gym_id):
+        # The gym with its fighters (and their records) and trainers, read in one round trip
+        results = self.execute_many_queries({
+            "gym": (f"SELECT {GYM_COLUMNS} FROM gyms g WHERE g.gym_id = %s", (gym_id,)),
+            "fighters": (f"""
+                SELECT {FIGHTER_DETAIL_COLUMNS}
+                FROM fighters f
+                {FIGHTER_DETAIL_JOINS}
+                WHERE f.gym_id = %s
+            """, (gym_id,)),
+            "trainers": (f"SELECT {TRAINER_COLUMNS} FROM trainers t WHERE t.gym_id = %s", (gym_id,)),
+        })
+
+        if not results or not results["gym"]:
+            return None
+        return {**results["gym"][0], "fighters": results["fighters"], "trainers": results["trainers"]}
 
     def get_fighter(self, field="fighter_id", value=1):
         conn = self.get_connection()
@@ -368,9 +1736,10 @@ class Database:
 
         except Error as e:
             print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def get_fighter_with_record(self, fighter_id):
         conn = self.get_connection()
@@ -379,8 +1748,8 @@ class Database:
         
         try:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT f.*, fr.wins, fr.losses, fr.draws
+                cur.execute(f"""
+                    SELECT {FIGHTER_COLUMNS}, fr.wins, fr.losses, fr.draws
                     FROM fighters f
                     LEFT JOIN fighter_records fr ON f.fighter_id = fr.fighter_id
                     WHERE f.fighter_id = %s
@@ -390,9 +1759,10 @@ class Database:
 
         except Error as e:
             print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def get_fighter_trainers(self, fighter_id):
         conn = self.get_connection()
@@ -415,9 +1785,10 @@ class Database:
 
         except Error as e:
             print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def get_fighter_matches(self, fighter_id):
         conn = self.get_connection()
@@ -439,9 +1810,10 @@ class Database:
 
         except Error as e:
             print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def get_trainer(self, field="trainer_id", value=1):
         conn = self.get_connection()
@@ -464,9 +1836,32 @@ class Database:
 
         except Error as e:
             print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
+
+    def get_trainer_details(self, trainer_id):
+        # The trainer with gym details and fighters, read in one round trip
+        results = self.execute_many_queries({
+            "trainer": (f"""
+                SELECT {TRAINER_COLUMNS}, g.name AS gym_name, g.location AS gym_location,
+                       g.owner AS gym_owner, g.reputation_score AS gym_reputation
+                FROM trainers t
+                LEFT JOIN gyms g ON g.gym_id = t.gym_id
+                WHERE t.trainer_id = %s
+            """, (trainer_id,)),
+            "fighters": (f"""
+                SELECT {FIGHTER_COLUMNS}, ft.start_date, ft.end_date
+                FROM fighters f
+                JOIN fighter_trainer ft ON ft.fighter_id = f.fighter_id
+                WHERE ft.trainer_id = %s
+            """, (trainer_id,)),
+        })
+
+        if not results or not results["trainer"]:
+            return None
+        return {**results["trainer"][0], "fighters": results["fighters"]}
 
     def get_trainer_fighters(self, trainer_id):
         conn = self.get_connection()
@@ -489,9 +1884,10 @@ class Database:
 
         except Error as e:
             print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def get_match_fighters(self, match_id):
         conn = self.get_connection()
@@ -541,9 +1937,10 @@ class Database:
 
         except Error as e:
             print(f"Error fetching match fighters:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def get_match_by_date(self, start_date, end_date, limit=100):
         conn = self.get_connection()
@@ -566,137 +1963,224 @@ class Database:
         
         except Error as e:
             print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
+
+    def search_gyms(self, search_term, limit=100, include_counts=False, include_members=False, cursor=None,
+                    fields=None):
+        # Best matches first; gym_id breaks ties between equally ranked gyms
+        after, after_params = keyset_condition(["ranked.rank", "ranked.gym_id"], cursor)
+        selected = gym_columns(include_counts, include_members, fields)
 
-    def search_gyms(self, search_term, limit=100):
         conn = self.get_connection()
         if conn is None:
             raise ConnectionError("Failed to connect to Database.")
-        
+
         try:
             with conn.cursor() as cur:
-                search_term = f"%{search_term}%"
-                cur.execute("""
-                    SELECT gym_id, name, location, owner, reputation_score
-                    FROM gyms
-                    WHERE name ILIKE %s OR location ILIKE %s OR owner ILIKE %s
-                    ORDER BY gym_id DESC
+                columns = TRIGRAM_INDEXES["gyms"]
+                pattern = f"%{search_term}%"
+                cur.execute(f"""
+                    SELECT * FROM (
+                        SELECT {selected},
+                               {search_rank(f"g.{column}" for column in columns)} AS rank
+                        FROM gyms g
+                        WHERE g.name ILIKE %s OR g.location ILIKE %s OR g.owner ILIKE %s
+                    ) ranked
+                    WHERE {after}
+                    ORDER BY ranked.rank DESC, ranked.gym_id DESC
                     LIMIT %s
-                """, (search_term, search_term, search_term, limit))
+                """, (*[search_term] * len(columns), *[pattern] * len(columns), *after_params, limit + 1))
 
-                return cur.fetchall()
+                return keyset_page(cur.fetchall(), limit, ["rank", "gym_id"])
 
         except Error as e:
             print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
+
+    def search_fighters(self, search_term, limit=100, include_details=False, cursor=None, fields=None,
+                        filters=None):
+        after, after_params = keyset_condition(["ranked.rank", "ranked.fighter_id"], cursor)
+        selected, joins = fighter_columns(include_details, fields)
+        where, where_params = filter_condition(FIGHTER_FILTERS, filters)
 
-    def search_fighters(self, search_term, limit=100):
         conn = self.get_connection()
         if conn is None:
             raise ConnectionError("Failed to connect to Database.")
-        
+
         try:
             with conn.cursor() as cur:
-                search_term = f"%{search_term}%"
-                cur.execute("""
-                    SELECT fighter_id, name, nickname, weight_class, height, age, nationality, status, gym_id
-                    FROM fighters
-                    WHERE name ILIKE %s OR nickname ILIKE %s
-                    ORDER BY fighter_id DESC
+                columns = TRIGRAM_INDEXES["fighters"]
+                pattern = f"%{search_term}%"
+                cur.execute(f"""
+                    SELECT * FROM (
+                        SELECT {selected},
+                               {search_rank(f"f.{column}" for column in columns)} AS rank
+                        FROM fighters f
+                        {joins}
+                        WHERE (f.name ILIKE %s OR f.nickname ILIKE %s) AND {where}
+                    ) ranked
+                    WHERE {after}
+                    ORDER BY ranked.rank DESC, ranked.fighter_id DESC
                     LIMIT %s
-                """, (search_term, search_term, limit))
+                """, (*[search_term] * len(columns), *[pattern] * len(columns), *where_params, *after_params,
+                      limit + 1))
 
-                return cur.fetchall()
+                return keyset_page(cur.fetchall(), limit, ["rank", "fighter_id"])
 
         except Error as e:
             print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
+
+    def search_trainers(self, search_term, limit=100, include_details=False, cursor=None, fields=None,
+                        filters=None):
+        after, after_params = keyset_condition(["ranked.rank", "ranked.trainer_id"], cursor)
+        selected, joins = trainer_columns(include_details, fields)
+        where, where_params = filter_condition(TRAINER_FILTERS, filters)
 
-    def search_trainers(self, search_term, limit=100):
         conn = self.get_connection()
         if conn is None:
             raise ConnectionError("Failed to connect to Database.")
-        
+
         try:
             with conn.cursor() as cur:
-                search_term = f"%{search_term}%"
-                cur.execute("""
-                    SELECT trainer_id, name, specialty, gym_id
-                    FROM trainers
-                    WHERE name ILIKE %s OR specialty ILIKE %s
-                    ORDER BY trainer_id DESC
+                columns = TRIGRAM_INDEXES["trainers"]
+                pattern = f"%{search_term}%"
+                cur.execute(f"""
+                    SELECT * FROM (
+                        SELECT {selected},
+                               {search_rank(f"t.{column}" for column in columns)} AS rank
+                        FROM trainers t
+                        {joins}
+                        WHERE (t.name ILIKE %s OR t.specialty ILIKE %s) AND {where}
+                    ) ranked
+                    WHERE {after}
+                    ORDER BY ranked.rank DESC, ranked.trainer_id DESC
                     LIMIT %s
-                """, (search_term, search_term, limit))
+                """, (*[search_term] * len(columns), *[pattern] * len(columns), *where_params, *after_params,
+                      limit + 1))
 
-                return cur.fetchall()
+                return keyset_page(cur.fetchall(), limit, ["rank", "trainer_id"])
 
         except Error as e:
             print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
+
+    def search_matches(self, search_term, limit=100, cursor=None, fields=None):
+        # Best matches first, then the most recent; match_id breaks ties between matches that start at the same time
+        after, after_params = keyset_condition(["ranked.rank", "ranked.start_date", "ranked.match_id"], cursor)
+        selected = select_fields(MATCH_LIST_FIELDS, fields, ["match_id", "start_date"])
 
-    def search_matches(self, search_term, limit=100):
         conn = self.get_connection()
         if conn is None:
             raise ConnectionError("Failed to connect to Database.")
-        
+
         try:
             with conn.cursor() as cur:
-                search_term = f"%{search_term}%"
-                
-                # Use EXTRACT to get duration as a string instead of interval
-                cur.execute("""
-                    SELECT DISTINCT 
-                        m.match_id, 
-                        m.start_date, 
-                        m.end_date, 
-                        EXTRACT(EPOCH FROM (m.end_date - m.start_date)) as duration_seconds,
-                        m.location
-                    FROM match_events m
-                    WHERE m.location ILIKE %s
-                    ORDER BY m.start_date DESC
+                pattern = f"%{search_term}%"
+                cur.execute(f"""
+                    SELECT * FROM (
+                        SELECT {selected}, {search_rank(["m.location"])} AS rank
+                        FROM match_events m
+                        {MATCH_LIST_JOINS}
+                        WHERE m.location ILIKE %s
+                    ) ranked
+                    WHERE {after}
+                    ORDER BY ranked.rank DESC, ranked.start_date DESC, ranked.match_id DESC
                     LIMIT %s
-                """, (search_term, limit))
-                
-                matches = cur.fetchall()
-                
-                # Convert duration from seconds to string format
-                for match in matches:
-                    if match['duration_seconds']:
-                        total_seconds = int(match['duration_seconds'])
-                        hours = total_seconds // 3600
-                        minutes = (total_seconds % 3600) // 60
-                        seconds = total_seconds % 60
-                        match['duration'] = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                    else:
-                        match['duration'] = None
-                
-                # For each match, get fighter details
-                result = []
-                for match in matches:
-                    match_id = match['match_id']
-                    fighter_details = self.get_match_fighters(match_id)
-                    
-                    if fighter_details:
-                        match_dict = dict(match)
-                        match_dict.update(fighter_details)
-                        result.append(match_dict)
+                """, (search_term, pattern, *after_params, limit + 1))
                 
+                result = keyset_page(cur.fetchall(), limit, ["rank", "start_date", "match_id"])
                 print(f"DEBUG: Found {len(result)} matches for search term: {search_term}")
                 return result
                     
         except Error as e:
             print(f"Error searching matches:\n{e}")
+            self._rollback(conn)
+            return None
+        finally:
+            self.release_connection(conn)
+
+    def search_all(self, search_term, limit=5):
+        # One round trip for every entity type: each branch uses its GIN index and keeps its own best `limit` results
+        query = prefix_tsquery(search_term)
+        if not query:
+            return []
+
+        conn = self.get_connection()
+        if conn is None:
+            raise ConnectionError("Failed to connect to Database.")
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    (SELECT 'fighter' AS type, f.fighter_id AS id, f.name, f.nickname AS detail,
+                            ts_rank(f.search_vector, to_tsquery('simple', %(query)s)) AS rank
+                     FROM fighters f
+                     WHERE f.search_vector @@ to_tsquery('simple', %(query)s)
+                     ORDER BY rank DESC, f.fighter_id DESC
+                     LIMIT %(limit)s)
+                    UNION ALL
+                    (SELECT 'gym', g.gym_id, g.name, g.location,
+                            ts_rank(g.search_vector, to_tsquery('simple', %(query)s)) AS rank
+                     FROM gyms g
+                     WHERE g.search_vector @@ to_tsquery('simple', %(query)s)
+                     ORDER BY rank DESC, g.gym_id DESC
+                     LIMIT %(limit)s)
+                    UNION ALL
+                    (SELECT 'trainer', t.trainer_id, t.name, t.specialty,
+                            ts_rank(t.search_vector, to_tsquery('simple', %(query)s)) AS rank
+                     FROM trainers t
+                     WHERE t.search_vector @@ to_tsquery('simple', %(query)s)
+                     ORDER BY rank DESC, t.trainer_id DESC
+                     LIMIT %(limit)s)
+                    UNION ALL
+                    (SELECT 'match', m.match_id, m.location, to_char(m.start_date, 'YYYY-MM-DD HH24:MI'),
+                            ts_rank(m.search_vector, to_tsquery('simple', %(query)s)) AS rank
+                     FROM match_events m
+                     WHERE m.search_vector @@ to_tsquery('simple', %(query)s)
+                     ORDER BY rank DESC, m.match_id DESC
+                     LIMIT %(limit)s)
+                    ORDER BY rank DESC, type, id DESC
+                """, {"query": query, "limit": limit})
+
+                return cur.fetchall()
+
+        except Error as e:
+            print(f"Error searching:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
+
+    def get_existing_ids(self, table, column, ids):
+        # The ids out of the given ones that exist in table.column, for validating references before a bulk write
+        conn = self.get_connection()
+        if conn is None:
+            raise ConnectionError("Failed to connect to Database.")
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT {column} FROM {table} WHERE {column} = ANY(%s)", (list(ids),))
+                return {row[column] for row in cur.fetchall()}
+
+        except Error as e:
+            print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
+            return None
+        finally:
+            self.release_connection(conn)
 
     def create_gym(self, name, location, owner, reputation_score=75):
         conn = self.get_connection()
@@ -712,15 +2196,62 @@ class Database:
                 """, (name, location, owner, reputation_score))
 
                 gym_id = cur.fetchone()['gym_id'] # type: ignore
-                conn.commit()
+                self._commit(conn, ("gyms",))
                 return gym_id
 
         except Error as e:
             print(f"Error writing information:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
+
+    def create_gyms_bulk(self, rows):
+        # rows are (name, location, owner, reputation_score); returns the new ids in the same order
+        conn = self.get_connection()
+        if conn is None:
+            raise ConnectionError("Failed to connect to Database.")
+
+        try:
+            with conn.cursor() as cur:
+                gyms = execute_values(cur, """
+                    INSERT INTO gyms (name, location, owner, reputation_score)
+                    VALUES %s
+                    RETURNING gym_id
+                """, rows, page_size=BULK_PAGE_SIZE, fetch=True)
+
+                self._commit(conn, ("gyms",))
+                return [gym['gym_id'] for gym in gyms]
+
+        except Error as e:
+            print(f"Error writing information:\n{e}")
+            self._rollback(conn)
+            return None
+        finally:
+            self.release_connection(conn)
+
+    def get_existing_gym_keys(self, keys):
+        # The (name, location) pairs that are already taken, out of the given ones
+        conn = self.get_connection()
+        if conn is None:
+            raise ConnectionError("Failed to connect to Database.")
+
+        try:
+            with conn.cursor() as cur:
+                rows = execute_values(cur, """
+                    SELECT g.name, g.location
+                    FROM gyms g
+                    JOIN (VALUES %s) AS k(name, location) ON k.name = g.name AND k.location = g.location
+                """, list(keys), page_size=BULK_PAGE_SIZE, fetch=True)
+
+                return {(row['name'], row['location']) for row in rows}
+
+        except Error as e:
+            print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
+            return None
+        finally:
+            self.release_connection(conn)
 
     def update_gym(self, gym_id, field, value):
         conn = self.get_connection()
@@ -739,15 +2270,15 @@ class Database:
                     WHERE gym_id = %s
                 """, (value, gym_id))
 
-                conn.commit()
+                self._commit(conn, ("gyms",))
                 return True
 
         except Error as e:
             print(f"Error updating information:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def delete_gym(self, gym_id):
         conn = self.get_connection()
@@ -761,15 +2292,15 @@ class Database:
                     WHERE gym_id = %s
                 """, (gym_id,))
 
-                conn.commit()
+                self._commit(conn, ("gyms",))
                 return True
 
         except Error as e:
             print(f"Error deleting information:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def create_fighter(self, name, nickname, weight_class, height, age, nationality, status, gym_id):
         conn = self.get_connection()
@@ -791,15 +2322,46 @@ class Database:
                     VALUES (%s, 0, 0, 0)
                 """, (fighter_id,))
 
-                conn.commit()
+                self._commit(conn, ("fighters",))
                 return fighter_id
 
         except Error as e:
             print(f"Error writing information:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
+            return None
+        finally:
+            self.release_connection(conn)
+
+    def create_fighters_bulk(self, rows):
+        # rows are (name, nickname, weight_class, height, age, nationality, status, gym_id);
+        # returns the new ids in the same order, each with an empty record like create_fighter
+        conn = self.get_connection()
+        if conn is None:
+            raise ConnectionError("Failed to connect to Database.")
+
+        try:
+            with conn.cursor() as cur:
+                fighters = execute_values(cur, """
+                    WITH inserted AS (
+                        INSERT INTO fighters (name, nickname, weight_class, height, age, nationality, status, gym_id)
+                        VALUES %s
+                        RETURNING fighter_id
+                    ), records AS (
+                        INSERT INTO fighter_records (fighter_id, wins, losses, draws)
+                        SELECT fighter_id, 0, 0, 0 FROM inserted
+                    )
+                    SELECT fighter_id FROM inserted
+                """, rows, page_size=BULK_PAGE_SIZE, fetch=True)
+
+                self._commit(conn, ("fighters",))
+                return [fighter['fighter_id'] for fighter in fighters]
+
+        except Error as e:
+            print(f"Error writing information:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def update_fighter(self, fighter_id, field, value):
         conn = self.get_connection()
@@ -818,15 +2380,15 @@ class Database:
                     WHERE fighter_id = %s
                 """, (value, fighter_id))
 
-                conn.commit()
+                self._commit(conn, ("fighters",))
                 return True
 
         except Error as e:
             print(f"Error updating information:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def delete_fighter(self, fighter_id):
         conn = self.get_connection()
@@ -840,15 +2402,15 @@ class Database:
                     WHERE fighter_id = %s
                 """, (fighter_id,))
 
-                conn.commit()
+                self._commit(conn, ("fighters",))
                 return True
 
         except Error as e:
             print(f"Error deleting information:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def create_trainer(self, name, specialty, gym_id):
         conn = self.get_connection()
@@ -864,15 +2426,39 @@ class Database:
                 """, (name, specialty, gym_id))
 
                 trainer_id = cur.fetchone()['trainer_id'] # type: ignore
-                conn.commit()
+                self._commit(conn, ("trainers",))
                 return trainer_id
 
         except Error as e:
             print(f"Error writing information:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
+
+    def create_trainers_bulk(self, rows):
+        # rows are (name, specialty, gym_id); returns the new ids in the same order
+        conn = self.get_connection()
+        if conn is None:
+            raise ConnectionError("Failed to connect to Database.")
+
+        try:
+            with conn.cursor() as cur:
+                trainers = execute_values(cur, """
+                    INSERT INTO trainers (name, specialty, gym_id)
+                    VALUES %s
+                    RETURNING trainer_id
+                """, rows, page_size=BULK_PAGE_SIZE, fetch=True)
+
+                self._commit(conn, ("trainers",))
+                return [trainer['trainer_id'] for trainer in trainers]
+
+        except Error as e:
+            print(f"Error writing information:\n{e}")
+            self._rollback(conn)
+            return None
+        finally:
+            self.release_connection(conn)
 
     def update_trainer(self, trainer_id, field, value):
         conn = self.get_connection()
@@ -891,15 +2477,15 @@ class Database:
                     WHERE trainer_id = %s
                 """, (value, trainer_id))
 
-                conn.commit()
+                self._commit(conn, ("trainers",))
                 return True
 
         except Error as e:
             print(f"Error updating information:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def delete_trainer(self, trainer_id):
         conn = self.get_connection()
@@ -913,76 +2499,114 @@ class Database:
                     WHERE trainer_id = %s
                 """, (trainer_id,))
 
-                conn.commit()
+                self._commit(conn, ("trainers",))
                 return True
 
         except Error as e:
             print(f"Error deleting information:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def create_match(self, start_date, location, fighter1_id, fighter2_id, end_date, winner_id):
+        if fighter1_id == fighter2_id:
+            raise ValueError("Fighters can't fight themselves.")
+
         conn = self.get_connection()
         if conn is None:
             raise ConnectionError("Failed to connect to Database.")
-        
-        if fighter1_id == fighter2_id:
-            raise ValueError("Fighters can't fight themselves.")
-        
-        if end_date < start_date:
-            raise ValueError("End Date can't be earlier than Start Date.")
 
         try:
             with conn.cursor() as cur:
+                # The match, both participants and both records are written by one server-side call
                 cur.execute("""
-                    INSERT INTO match_events (start_date, end_date, location)
-                    VALUES (%s, %s, %s)
-                    RETURNING match_id
-                """, (start_date, end_date, location))
+                    SELECT create_match(%s, %s, %s, %s, %s, %s) AS match_id
+                """, (start_date, end_date, location, fighter1_id, fighter2_id, winner_id))
                 match_id = cur.fetchone()['match_id'] # type: ignore
 
-                fighter1_result = None
-                fighter2_result = None
-
-                if winner_id == fighter1_id:
-                    fighter1_result = "win"
-                    fighter2_result = "loss"
-                elif winner_id == fighter2_id:
-                    fighter1_result = "loss"
-                    fighter2_result = "win"
-                elif winner_id == 0:
-                    fighter1_result = "draw"
-                    fighter2_result = "draw"
-                else:
-                    fighter1_result = "no contest"
-                    fighter2_result = "no contest"
+                self._commit(conn, ("match_events", "participants"))
+                return match_id
 
-                cur.execute("""
-                    INSERT INTO participants (match_id, fighter_id, result)
-                    VALUES (%s, %s, %s)
-                """, (match_id, fighter1_id, fighter1_result))
+        except errors.InvalidParameterValue as e:
+            self._rollback(conn)
+            raise ValueError(e.diag.message_primary)
+        except Error as e:
+            print(f"Error writing information:\n{e}")
+            self._rollback(conn)
+            return None
+        finally:
+            self.release_connection(conn)
 
-                cur.execute("""
-                    INSERT INTO participants (match_id, fighter_id, result)
-                    VALUES (%s, %s, %s)
-                """, (match_id, fighter2_id, fighter2_result))
+    def find_match_errors(self, rows):
+        # {position: error} for the rows create_matches_bulk() would reject, by the rules create_match() applies
+        conn = self.get_connection()
+        if conn is None:
+            raise ConnectionError("Failed to connect to Database.")
 
-                if fighter1_result and fighter1_result != "no contest":
-                    self.add_fighter_record(conn, fighter1_id, fighter1_result)
-                if fighter2_result and fighter2_result != "no contest":
-                    self.add_fighter_record(conn, fighter2_id, fighter2_result)
+        try:
+            with conn.cursor() as cur:
+                return self._match_errors(cur, rows)
 
-                conn.commit()
-                return match_id
+        except Error as e:
+            print(f"Error fetching information:\n{e}")
+            self._rollback(conn)
+            return None
+        finally:
+            self.release_connection(conn)
+
+    def _match_errors(self, cur, rows):
+        # The whole batch is checked by one statement
+        invalid = execute_values(cur, """
+            SELECT v.position, match_error(v.start_date, v.end_date, v.fighter1_id, v.fighter2_id, v.winner_id) AS error
+            FROM (VALUES %s) AS v(position, start_date, end_date, fighter1_id, fighter2_id, winner_id)
+            WHERE match_error(v.start_date, v.end_date, v.fighter1_id, v.fighter2_id, v.winner_id) IS NOT NULL
+        """, [(position, row[0], row[1], *row[3:]) for position, row in enumerate(rows)],
+            template="(%s::integer, %s::timestamp, %s::timestamp, %s::integer, %s::integer, %s::integer)",
+            page_size=BULK_PAGE_SIZE, fetch=True)
+        return {row['position']: row['error'] for row in invalid}
+
+    def create_matches_bulk(self, rows):
+        # rows are (start_date, end_date, location, fighter1_id, fighter2_id, winner_id); returns the new ids in order.
+        # Matches and participants go in as two multi-row statements per page instead of a create_match call per row.
+        conn = self.get_connection()
+        if conn is None:
+            raise ConnectionError("Failed to connect to Database.")
+
+        try:
+            with conn.cursor() as cur:
+                # Callers report these per row with find_match_errors() first; this only keeps the rules enforced
+                invalid = self._match_errors(cur, rows)
+                if invalid:
+                    position, error = min(invalid.items())
+                    raise ValueError(f"Match {position}: {error}")
+
+                matches = execute_values(cur, """
+                    INSERT INTO match_events (start_date, end_date, location)
+                    VALUES %s
+                    RETURNING match_id
+                """, [row[:3] for row in rows], page_size=BULK_PAGE_SIZE, fetch=True)
+                match_ids = [match['match_id'] for match in matches]
+
+                execute_values(cur, """
+                    INSERT INTO participants (match_id, fighter_id, result)
+                    SELECT v.match_id, f.fighter_id, match_result(f.fighter_id, f.opponent_id, v.winner_id)
+                    FROM (VALUES %s) AS v(match_id, fighter1_id, fighter2_id, winner_id)
+                    CROSS JOIN LATERAL (
+                        VALUES (v.fighter1_id, v.fighter2_id), (v.fighter2_id, v.fighter1_id)
+                    ) AS f(fighter_id, opponent_id)
+                """, [(match_id, *row[3:]) for match_id, row in zip(match_ids, rows)],
+                    template="(%s::integer, %s::integer, %s::integer, %s::integer)", page_size=BULK_PAGE_SIZE)
+
+                self._commit(conn, ("match_events", "participants"))
+                return match_ids
 
         except Error as e:
             print(f"Error writing information:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def update_match(self, match_id, field, value):
         conn = self.get_connection()
@@ -1001,165 +2625,68 @@ class Database:
                     WHERE match_id = %s
                 """, (value, match_id))
 
-                conn.commit()
+                self._commit(conn, ("match_events",))
                 return True
             
         except Error as e:
             print(f"Error updating information:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def update_match_player(self, match_id, old_fighter_id, new_fighter_id):
+        if old_fighter_id == new_fighter_id:
+            raise ValueError("Old fighter and new fighter IDs cannot be the same.")
+
         conn = self.get_connection()
         if conn is None:
             raise ConnectionError("Failed to connect to Database.")
-        
-        if old_fighter_id == new_fighter_id:
-            raise ValueError("Old fighter and new fighter IDs cannot be the same.")
 
         try:
             with conn.cursor() as cur:
                 cur.execute("""
-                    SELECT fighter_id 
-                    FROM participants 
-                    WHERE match_id = %s AND fighter_id = %s
-                """, (match_id, new_fighter_id))
-                
-                if cur.fetchone() is not None:
-                    raise ValueError(f"Fighter with ID {new_fighter_id} is already a participant in this match.")
-
-                cur.execute("""
-                    SELECT result
-                    FROM participants
-                    WHERE match_id = %s AND fighter_id = %s
-                """, (match_id, old_fighter_id))
-
-                result = cur.fetchone()
-                result = result["result"] if result else None # type: ignore
-
-                if result is None:
-                    raise ValueError(f"Fighter with ID: {old_fighter_id} did not participate in this match.")
-
-                if result == "win":
-                    cur.execute("""
-                    UPDATE fighter_records
-                    SET wins = wins - 1
-                    WHERE fighter_id = %s    
-                """, (old_fighter_id,))
-                elif result == "draw":
-                    cur.execute("""
-                    UPDATE fighter_records
-                    SET draws = draws - 1
-                    WHERE fighter_id = %s    
-                """, (old_fighter_id,))
-                elif result == "loss":
-                    cur.execute("""
-                    UPDATE fighter_records
-                    SET losses = losses - 1
-                    WHERE fighter_id = %s    
-                """, (old_fighter_id,))
-                    
-                self.add_fighter_record(conn, new_fighter_id, result)
+                    SELECT update_match_player(%s, %s, %s) AS updated
+                """, (match_id, old_fighter_id, new_fighter_id))
+                updated = cur.fetchone()['updated'] # type: ignore
 
-                cur.execute("""
-                    UPDATE participants
-                    SET fighter_id = %s
-                    WHERE match_id = %s AND fighter_id = %s
-                """, (new_fighter_id, match_id, old_fighter_id))
+                self._commit(conn, ("participants",))
+                return updated
 
-                conn.commit()
-                return True
-            
+        except errors.InvalidParameterValue as e:
+            self._rollback(conn)
+            raise ValueError(e.diag.message_primary)
         except Error as e:
             print(f"Error updating information:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def update_match_result(self, match_id, winner_id):
         conn = self.get_connection()
         if conn is None:
             raise ConnectionError("Failed to connect to Database.")
-        
+
         try:
             with conn.cursor() as cur:
                 cur.execute("""
-                    SELECT fighter_id 
-                    FROM participants 
-                    WHERE match_id = %s
-                    LIMIT 2
-                """, (match_id,))
+                    SELECT update_match_result(%s, %s) AS updated
+                """, (match_id, winner_id))
+                updated = cur.fetchone()['updated'] # type: ignore
 
-                fighters = cur.fetchall()
-                fighter1_id = fighters[0]["fighter_id"] # type: ignore
-                fighter2_id = fighters[1]["fighter_id"] # type: ignore
-                
-                fighter1_result = None
-                fighter2_result = None      
-                
-                if winner_id == fighter1_id:
-                    fighter1_result = "win"
-                    fighter2_result = "loss"
-                elif winner_id == fighter2_id:
-                    fighter1_result = "loss"
-                    fighter2_result = "win"
-                elif winner_id == 0:
-                    fighter1_result = "draw"
-                    fighter2_result = "draw"
-                else:
-                    fighter1_result = "no contest"
-                    fighter2_result = "no contest"
-
-                cur.execute("""
-                    SELECT result 
-                    FROM participants 
-                    WHERE match_id = %s AND fighter_id = %s
-                """, (match_id, fighter1_id))
-
-                current_fighter1_result = cur.fetchone()
-                current_fighter1_result = current_fighter1_result["result"] if current_fighter1_result else None # type: ignore
-                
-                cur.execute("""
-                    SELECT result 
-                    FROM participants 
-                    WHERE match_id = %s AND fighter_id = %s
-                """, (match_id, fighter2_id))
-
-                current_fighter2_result = cur.fetchone()
-                current_fighter2_result = current_fighter2_result["result"] if current_fighter2_result else None # type: ignore
-                
-                cur.execute("""
-                    UPDATE participants
-                    SET result = %s
-                    WHERE match_id = %s AND fighter_id = %s
-                """, (fighter1_result, match_id, fighter1_id))
-                
-                cur.execute("""
-                    UPDATE participants
-                    SET result = %s
-                    WHERE match_id = %s AND fighter_id = %s
-                """, (fighter2_result, match_id, fighter2_id))
-                
-                if current_fighter1_result in ('win', 'loss', 'draw'):
-                    if fighter1_result in ('win', 'loss', 'draw') and fighter1_result != current_fighter1_result:
-                        self.update_fighter_record(conn, fighter1_id, fighter1_result, current_fighter1_result)
-                
-                if current_fighter2_result in ('win', 'loss', 'draw'):
-                    if fighter2_result in ('win', 'loss', 'draw') and fighter2_result != current_fighter2_result:
-                        self.update_fighter_record(conn, fighter2_id, fighter2_result, current_fighter2_result)
-
-                conn.commit()
-                return True
+                self._commit(conn, ("participants",))
+                return updated
 
+        except errors.InvalidParameterValue as e:
+            self._rollback(conn)
+            raise ValueError(e.diag.message_primary)
         except Error as e:
             print(f"Error updating information:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def delete_match(self, match_id):
         conn = self.get_connection()
@@ -1168,109 +2695,54 @@ class Database:
         
         try:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT fighter_id, result
-                    FROM participants
-                    WHERE match_id = %s
-                """, (match_id,))
-
-                participants = cur.fetchall()
-                for participant in participants:
-                    fighter_id = participant["fighter_id"] # type: ignore
-                    result = participant["result"] # type: ignore
-
-                    if result == "win":
-                        cur.execute(
-                            "UPDATE fighter_records SET wins = wins - 1 WHERE fighter_id = %s",
-                            (fighter_id,)
-                        )
-                    elif result == "loss":
-                        cur.execute(
-                            "UPDATE fighter_records SET losses = losses - 1 WHERE fighter_id = %s",
-                            (fighter_id,)
-                        )
-                    elif result == "draw":
-                        cur.execute(
-                            "UPDATE fighter_records SET draws = draws - 1 WHERE fighter_id = %s",
-                            (fighter_id,)
-                        )
-
+                # Cascading to participants takes the result back out of both records through the triggers
                 cur.execute("""
                     DELETE FROM match_events
                     WHERE match_id = %s
                 """, (match_id,))
 
-                conn.commit()
+                self._commit(conn, ("match_events",))
                 return True
 
         except Error as e:
             print(f"Error deleting information:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
     
-    def add_fighter_record(self, conn, fighter_id, result):
+    def rebuild_fighter_records(self):
+        # Recomputes every record from participants, for data loaded with the triggers disabled or bypassed
+        conn = self.get_connection()
         if conn is None:
             raise ConnectionError("Failed to connect to Database.")
-        
-        try:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT fighter_id
-                    FROM fighter_records
-                    WHERE fighter_id = %s
-                """, (fighter_id,))
-
-                record = cur.fetchone()
-                if record:
-                    cur.execute("""
-                        UPDATE fighter_records
-                        SET wins = wins + %s, losses = losses + %s, draws = draws + %s
-                        WHERE fighter_id = %s
-                    """, (1 if result == 'win' else 0, 1 if result == 'loss' else 0, 1 if result == 'draw' else 0, fighter_id))
-                else:
-                    cur.execute("""
-                        INSERT INTO fighter_records (fighter_id, wins, losses, draws)
-                        VALUES (%s, %s, %s, %s)
-                    """, (fighter_id, 1 if result == 'win' else 0, 1 if result == 'loss' else 0, 1 if result == 'draw' else 0))
-
-                return True
-
-        except Error as e:
-            print(f"Error writing information:\n{e}")
-            conn.rollback()
-            return False
 
-    def update_fighter_record(self, conn, fighter_id, result, current_result):
-        if conn is None:
-            raise ConnectionError("Failed to connect to Database.")
-        
         try:
             with conn.cursor() as cur:
-                if result == current_result:
-                    return True
-
-                if current_result == "win":
-                    cur.execute("UPDATE fighter_records SET wins = wins - 1 WHERE fighter_id = %s", (fighter_id,))
-                elif current_result == "loss":
-                    cur.execute("UPDATE fighter_records SET losses = losses - 1 WHERE fighter_id = %s", (fighter_id,))
-                elif current_result == "draw":
-                    cur.execute("UPDATE fighter_records SET draws = draws - 1 WHERE fighter_id = %s", (fighter_id,))
-                
-                if result == "win":
-                    cur.execute("UPDATE fighter_records SET wins = wins + 1 WHERE fighter_id = %s", (fighter_id,))
-                elif result == "loss":
-                    cur.execute("UPDATE fighter_records SET losses = losses + 1 WHERE fighter_id = %s", (fighter_id,))
-                elif result == "draw":
-                    cur.execute("UPDATE fighter_records SET draws = draws + 1 WHERE fighter_id = %s", (fighter_id,))
+                cur.execute("""
+                    INSERT INTO fighter_records AS fr (fighter_id, wins, losses, draws)
+                    SELECT f.fighter_id,
+                           count(*) FILTER (WHERE p.result = 'win'),
+                           count(*) FILTER (WHERE p.result = 'loss'),
+                           count(*) FILTER (WHERE p.result = 'draw')
+                    FROM fighters f
+                    LEFT JOIN participants p ON p.fighter_id = f.fighter_id
+                    GROUP BY f.fighter_id
+                    ORDER BY f.fighter_id
+                    ON CONFLICT (fighter_id) DO UPDATE
+                    SET wins = EXCLUDED.wins, losses = EXCLUDED.losses, draws = EXCLUDED.draws
+                    WHERE (fr.wins, fr.losses, fr.draws) IS DISTINCT FROM (EXCLUDED.wins, EXCLUDED.losses, EXCLUDED.draws)
+                """)
 
-                return True
+                self._commit(conn, ("fighter_records",))
+                return cur.rowcount
 
         except Error as e:
             print(f"Error updating information:\n{e}")
-            conn.rollback()
-            return False
+            self._rollback(conn)
+            return None
+        finally:
+            self.release_connection(conn)
 
     def add_fighter_trainer(self, fighter_id, trainer_id):
         conn = self.get_connection()
@@ -1285,14 +2757,14 @@ class Database:
                     RETURNING ft_id
                 """, (fighter_id, trainer_id))
                 
-                conn.commit()
+                self._commit(conn, ("fighter_trainer",))
                 return True
         except Error as e:
             print(f"Error adding trainer to fighter:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def remove_fighter_trainer(self, fighter_id, trainer_id):
         conn = self.get_connection()
@@ -1307,14 +2779,35 @@ class Database:
                     WHERE fighter_id = %s AND trainer_id = %s AND end_date IS NULL
                 """, (fighter_id, trainer_id))
                 
-                conn.commit()
+                self._commit(conn, ("fighter_trainer",))
                 return True
         except Error as e:
             print(f"Error removing trainer from fighter:\n{e}")
-            conn.rollback()
+            self._rollback(conn)
             return False
         finally:
-            conn.close()
+            self.release_connection(conn)
+
+    def autocomplete(self, entity, prefix="", limit=10, without_gym=False):
+        if entity not in AUTOCOMPLETE_SOURCES:
+            raise ValueError(f"Unknown entity: {entity}")
+        if without_gym and entity == "gyms":
+            raise ValueError("Only fighters and trainers can be looked up without a gym.")
+        columns, source, name, key, tables = AUTOCOMPLETE_SOURCES[entity]
+        unaffiliated = f"AND {key.split('.')[0]}.gym_id IS NULL" if without_gym else ""
+
+        # Typing and backspacing repeats the same few prefixes, which the query cache answers
+        try:
+            return self.execute(f"""
+                SELECT {columns}
+                FROM {source}
+                WHERE lower({name}) LIKE %s {unaffiliated}
+                ORDER BY lower({name}) USING ~<~, {key}
+                LIMIT %s
+            """, (like_prefix(prefix.lower()), limit), fetch=True, tables=tables)
+        except Error as e:
+            print(f"Error fetching {entity}:\n{e}")
+            return None
 
     def get_all_fighters_without_gym(self):
         conn = self.get_connection()
@@ -1332,9 +2825,10 @@ class Database:
                 return cur.fetchall()
         except Error as e:
             print(f"Error fetching fighters:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def get_all_fighters_without_trainer(self, trainer_id=None):
         conn = self.get_connection()
@@ -1363,9 +2857,10 @@ class Database:
                 return cur.fetchall()
         except Error as e:
             print(f"Error fetching fighters:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
 
     def get_all_trainers_without_gym(self):
         conn = self.get_connection()
@@ -1383,8 +2878,9 @@ class Database:
                 return cur.fetchall()
         except Error as e:
             print(f"Error fetching trainers:\n{e}")
+            self._rollback(conn)
             return None
         finally:
-            conn.close()
+            self.release_connection(conn)
 
 db = Database()
\ No newline at end of file
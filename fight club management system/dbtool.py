@@ -0,0 +1,182 @@
+import os
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2 import Error
+from database import Database, CHANGE_COLUMNS
+
+# Tables in foreign key order: every table only references tables from earlier levels, so the tables
+# of one level can be imported in parallel. fighter_records is rebuilt from participants afterwards anyway.
+IMPORT_LEVELS = [
+    ["gyms"],
+    ["fighters", "trainers", "match_events"],
+    ["fighter_trainer", "fighter_records"],
+    ["participants"],
+]
+TABLES = [table for level in IMPORT_LEVELS for table in level]
+
+# NDJSON goes through COPY's CSV format with quote and delimiter characters that never occur in JSON text
+# (JSON escapes all control characters), so every line is copied verbatim with no quoting or escaping
+NDJSON_OPTIONS = "FORMAT csv, QUOTE e'\\x01', DELIMITER e'\\x02'"
+CSV_OPTIONS = "FORMAT csv, HEADER true"
+# HEADER match (PostgreSQL 15+) also checks the header against the column list, older servers only skip it
+CSV_IMPORT_OPTIONS = "FORMAT csv, HEADER match"
+
+def table_columns(cur, table):
+    # Generated columns (duration, search_vector) are computed by the database and can't be written.
+    # Change tracking columns hold transaction ids of the source database, so the target stamps its own.
+    cur.execute("""
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER'
+          AND column_name <> ALL(%s)
+        ORDER BY ordinal_position
+    """, (table, list(CHANGE_COLUMNS)))
+    return [row['column_name'] for row in cur.fetchall()]
+
+def table_path(directory, table, file_format):
+    return os.path.join(directory, f"{table}.{file_format}")
+
+def csv_import_options(conn):
+    return CSV_IMPORT_OPTIONS if conn.server_version >= 150000 else CSV_OPTIONS
+
+def release_snapshot_connection(db, conn):
+    # Back to the pool with the default session settings, or closed when the connection broke meanwhile
+    try:
+        conn.rollback()
+        conn.set_session(isolation_level="DEFAULT", readonly="DEFAULT")
+    except Error:
+        db.pool.putconn(conn, close=True)
+    else:
+        db.pool.putconn(conn)
+
+def export_table(db, table, directory, file_format, snapshot):
+    conn = db.pool.getconn()
+    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+
+    try:
+        with conn.cursor() as cur, open(table_path(directory, table, file_format), "w", encoding="utf-8") as file:
+            # Every worker reads the same snapshot, so the exported tables are consistent with each other
+            cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+            columns = ", ".join(table_columns(cur, table))
+
+            if file_format == "csv":
+                cur.copy_expert(f"COPY (SELECT {columns} FROM {table}) TO STDOUT WITH ({CSV_OPTIONS})", file)
+            else:
+                cur.copy_expert(f"""
+                    COPY (SELECT row_to_json(t) FROM (SELECT {columns} FROM {table}) t)
+                    TO STDOUT WITH ({NDJSON_OPTIONS})
+                """, file)
+
+            print(f"Exported {cur.rowcount} rows from {table}")
+            return cur.rowcount
+    finally:
+        release_snapshot_connection(db, conn)
+
+def import_table(db, table, directory, file_format):
+    conn = db.pool.getconn()
+
+    try:
+        with conn.cursor() as cur, open(table_path(directory, table, file_format), encoding="utf-8") as file:
+            columns = ", ".join(table_columns(cur, table))
+
+            if file_format == "csv":
+                cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH ({csv_import_options(conn)})", file)
+            else:
+                # Lines are staged as json first and expanded into the table's columns in one INSERT
+                cur.execute("CREATE TEMP TABLE import_rows (doc json) ON COMMIT DROP")
+                cur.copy_expert(f"COPY import_rows (doc) FROM STDIN WITH ({NDJSON_OPTIONS})", file)
+                cur.execute(f"""
+                    INSERT INTO {table} ({columns}) OVERRIDING SYSTEM VALUE
+                    SELECT {columns}
+                    FROM import_rows, json_populate_record(NULL::{table}, import_rows.doc)
+                """)
+            count = cur.rowcount
+
+            # Identity sequences have to continue after the imported ids
+            cur.execute("""
+                SELECT column_name
+                FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = %s AND is_identity = 'YES'
+            """, (table,))
+            for row in cur.fetchall():
+                column = row['column_name']
+                cur.execute(f"""
+                    SELECT setval(pg_get_serial_sequence(%s, %s), COALESCE(max({column}), 0) + 1, false)
+                    FROM {table}
+                """, (table, column))
+
+            conn.commit()
+            db.invalidate_cache([table])
+            print(f"Imported {count} rows into {table}")
+            return count
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db.pool.putconn(conn)
+
+def export_tables(db, tables, directory, file_format, jobs):
+    os.makedirs(directory, exist_ok=True)
+
+    # The exporting transaction stays open until every worker has started reading its snapshot
+    conn = db.pool.getconn()
+    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_export_snapshot() AS snapshot")
+            snapshot = cur.fetchone()['snapshot']
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(export_table, db, table, directory, file_format, snapshot) for table in tables]
+            return sum(future.result() for future in futures)
+    finally:
+        release_snapshot_connection(db, conn)
+
+def import_tables(db, tables, directory, file_format, jobs, truncate=False):
+    missing = [table for table in tables if not os.path.exists(table_path(directory, table, file_format))]
+    if missing:
+        raise FileNotFoundError(f"No {file_format} file for: {', '.join(missing)}")
+
+    if truncate:
+        db.execute(f"TRUNCATE {', '.join(tables)} CASCADE")
+        print(f"Truncated {', '.join(tables)}")
+
+    total = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for level in IMPORT_LEVELS:
+            futures = [executor.submit(import_table, db, table, directory, file_format)
+                       for table in level if table in tables]
+            total += sum(future.result() for future in futures)
+
+    # Participants go in through COPY, so recompute the records from them instead of trusting the file
+    if "participants" in tables or "fighter_records" in tables:
+        print(f"Rebuilt {db.rebuild_fighter_records()} fighter records")
+    return total
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export and import Fight Club tables with streaming COPY.")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("directory", help="directory holding one <table>.<format> file per table")
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--tables", nargs="+", choices=TABLES, default=TABLES)
+    parser.add_argument("--jobs", type=int, default=4, help="tables processed in parallel")
+    parser.add_argument("--truncate", action="store_true", help="empty the tables before importing")
+    args = parser.parse_args(argv)
+
+    jobs = max(1, args.jobs)
+    db = Database(max_connections=jobs + 1)
+    try:
+        if args.command == "export":
+            total = export_tables(db, args.tables, args.directory, args.format, jobs)
+        else:
+            total = import_tables(db, args.tables, args.directory, args.format, jobs, args.truncate)
+        print(f"{args.command.capitalize()}ed {total} rows in total")
+    except (Error, OSError) as e:
+        print(f"Error during {args.command}:\n{e}")
+        return 1
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
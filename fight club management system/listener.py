@@ -0,0 +1,125 @@
+import queue
+import select
+import threading
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class ChangeListener:
+    """Fans out NOTIFY payloads from one LISTEN connection to any number of subscriber queues.
+
+    The connection and its thread are started by the first subscriber and reconnect with a growing delay
+    when the connection is lost. Notifications are only delivered on commit and the database drops repeated
+    payloads within a transaction, so a subscriber receives each changed table once per committed write.
+    """
+
+    def __init__(self, dsn, channel, max_queue=1000, reconnect_delay=1.0, max_reconnect_delay=30.0):
+        self.dsn = dsn
+        self.channel = channel
+        self.max_queue = max_queue
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._thread = None
+        self._closed = threading.Event()
+        self._connected = False
+
+        self._notifications = 0
+        self._dropped = 0
+        self._rejected = 0
+        self._connections = 0
+        self._connection_failures = 0
+
+    def subscribe(self, limit=None):
+        # Each subscriber gets its own queue of changed table names; pass it back to unsubscribe().
+        # None when there are limit subscribers already.
+        subscriber = queue.Queue(self.max_queue)
+        with self._lock:
+            if limit is not None and len(self._subscribers) >= limit:
+                self._rejected += 1
+                return None
+            self._subscribers.add(subscriber)
+            if self._thread is None and not self._closed.is_set():
+                self._thread = threading.Thread(target=self._run, name="change-listener", daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'channel': self.channel,
+                'connected': self._connected,
+                'subscribers': len(self._subscribers),
+                'notifications': self._notifications,
+                'dropped': self._dropped,
+                'rejected': self._rejected,
+                'connections': self._connections,
+                'connection_failures': self._connection_failures,
+            }
+
+    def _run(self):
+        delay = self.reconnect_delay
+        missed = False
+        while not self._closed.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+                with self._lock:
+                    self._connected = True
+                    self._connections += 1
+                delay = self.reconnect_delay
+
+                # Writes made while the connection was down went unnoticed, so tell subscribers to reload everything
+                if missed:
+                    self._publish(None)
+                    missed = False
+
+                # Woken at least once a second to notice close()
+                while not self._closed.is_set():
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            self._publish(conn.notifies.pop(0).payload)
+            except (psycopg2.Error, OSError) as e:
+                with self._lock:
+                    self._connection_failures += 1
+                print(f"Error listening for database changes:\n{e}")
+                missed = True
+                self._closed.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+            finally:
+                with self._lock:
+                    self._connected = False
+                if conn is not None:
+                    conn.close()
+
+    def _publish(self, payload):
+        with self._lock:
+            if payload is not None:
+                self._notifications += 1
+            for subscriber in self._subscribers:
+                try:
+                    subscriber.put_nowait(payload)
+                except queue.Full:
+                    # A client too slow to keep up gets one None in place of its backlog: reload everything
+                    self._dropped += 1
+                    with subscriber.mutex:
+                        subscriber.queue.clear()
+                    subscriber.put_nowait(None)
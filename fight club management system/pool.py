@@ -0,0 +1,224 @@
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections with health checks and idle recycling."""
+
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=30.0, max_idle=300.0,
+                 max_lifetime=3600.0, check_interval=30.0, **connect_kwargs):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool size must satisfy 0 <= min_size <= max_size and max_size >= 1.")
+
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+        self.connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, returned_at), most recently returned on the right
+        self._created = {}  # conn -> created_at
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+
+        self._requests = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._connections_created = 0
+        self._connections_closed = 0
+        self._health_check_failures = 0
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        conn = None
+        returned_at = None
+        expired = []
+
+        with self._cond:
+            self._requests += 1
+            waited = False
+
+            while True:
+                if self._closed:
+                    raise PoolError("Connection pool is closed.")
+
+                expired.extend(self._take_expired_locked())
+
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolError(f"Timed out after {self.timeout}s waiting for a database connection.")
+
+                waited = True
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._in_use += 1
+            if waited:
+                wait_time = time.monotonic() - started
+                self._waits += 1
+                self._wait_time_total += wait_time
+                self._wait_time_max = max(self._wait_time_max, wait_time)
+
+        for stale in expired:
+            self._close(stale)
+
+        try:
+            if conn is not None and not self._is_healthy(conn, returned_at):
+                with self._cond:
+                    self._health_check_failures += 1
+                    self._created.pop(conn, None)
+                    self._connections_closed += 1
+                self._close(conn)
+                conn = None
+
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        return conn
+
+    def putconn(self, conn, close=False):
+        if conn is None:
+            return
+
+        discard = close or conn.closed or self._closed
+        if not discard:
+            status = conn.info.transaction_status
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        with self._cond:
+            if conn not in self._created:
+                raise PoolError("Connection does not belong to this pool.")
+
+            self._in_use -= 1
+            if not discard and self.max_lifetime and time.monotonic() - self._created[conn] > self.max_lifetime:
+                discard = True
+
+            if discard:
+                self._created.pop(conn, None)
+                self._size -= 1
+                self._connections_closed += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+        if discard:
+            self._close(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            for conn in idle:
+                self._created.pop(conn, None)
+            self._size -= len(idle)
+            self._connections_closed += len(idle)
+            self._cond.notify_all()
+
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'requests': self._requests,
+                'waits': self._waits,
+                'wait_time_total': round(self._wait_time_total, 6),
+                'wait_time_avg': round(self._wait_time_total / self._waits, 6) if self._waits else 0.0,
+                'wait_time_max': round(self._wait_time_max, 6),
+                'timeouts': self._timeouts,
+                'connections_created': self._connections_created,
+                'connections_closed': self._connections_closed,
+                'health_check_failures': self._health_check_failures,
+            }
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+        with self._cond:
+            self._created[conn] = time.monotonic()
+            self._connections_created += 1
+        return conn
+
+    def _take_expired_locked(self):
+        # Idle connections are ordered oldest-returned first, so only the left end needs checking.
+        now = time.monotonic()
+        expired = []
+
+        while self._idle and self._size > self.min_size:
+            conn, returned_at = self._idle[0]
+            too_idle = self.max_idle and now - returned_at > self.max_idle
+            too_old = self.max_lifetime and now - self._created[conn] > self.max_lifetime
+            if not (too_idle or too_old):
+                break
+
+            self._idle.popleft()
+            self._created.pop(conn, None)
+            self._size -= 1
+            self._connections_closed += 1
+            expired.append(conn)
+
+        return expired
+
+    def _is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if self.max_lifetime and time.monotonic() - self._created[conn] > self.max_lifetime:
+            return False
+        if time.monotonic() - returned_at < self.check_interval:
+            return True
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
@@ -0,0 +1,445 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from datetime import date, datetime, time as time_of_day, timedelta
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+# Shared entries are stored as JSON, never pickled: whoever can write to the store could otherwise run code in
+# every worker. Column types JSON has no counterpart for are tagged, so a hit returns the same types as a query.
+DECODERS = {
+    "$decimal": Decimal,
+    "$datetime": datetime.fromisoformat,
+    "$date": date.fromisoformat,
+    "$time": time_of_day.fromisoformat,
+    "$timedelta": lambda parts: timedelta(*parts),
+}
+
+def tag(value):
+    if isinstance(value, Decimal):
+        return {"$decimal": str(value)}
+    # datetime before date, it is a subclass
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    if isinstance(value, time_of_day):
+        return {"$time": value.isoformat()}
+    if isinstance(value, timedelta):
+        return {"$timedelta": [value.days, value.seconds, value.microseconds]}
+    raise TypeError(f"Object of type {type(value).__name__} can't be cached")
+
+def untag(obj):
+    if len(obj) == 1:
+        (key, value), = obj.items()
+        decode = DECODERS.get(key)
+        if decode is not None:
+            return decode(value)
+    return obj
+
+def dumps(value):
+    if orjson is not None:
+        # Dates and times go through tag() too instead of orjson's own ISO strings
+        return orjson.dumps(value, default=tag, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(value, default=tag, ensure_ascii=False, separators=(",", ":")).encode()
+
+def loads(data):
+    return json.loads(data, object_hook=untag)
+
+
+class QueryCache:
+    """Thread-safe LRU cache of query results with a TTL, invalidated by the tables each result was read from."""
+
+    def __init__(self, max_size=1000, ttl=30.0):
+        if max_size < 1 or ttl <= 0:
+            raise ValueError("Cache size and TTL must be positive.")
+
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, tables, value), least recently used on the left
+        self._tagged = {}  # table -> keys of the entries read from it
+        self._versions = {}  # table -> number of invalidations so far
+
+        self._hits = 0
+        self._misses = 0
+        self._expirations = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._skipped = 0
+
+    def get(self, key):
+        # Returns (True, value) on a hit and (False, None) on a miss
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                self._remove_locked(key)
+                self._expirations += 1
+                entry = None
+
+            if entry is None:
+                self._misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return True, entry[2]
+
+    def versions(self, tables):
+        # Taken before running a query and handed back to set(), see there
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+    def set(self, key, tables, value, versions):
+        tables = tuple(tables)
+        with self._lock:
+            # A write to one of the tables was committed while the query ran, so the result may
+            # already be stale; storing it would keep it around until the TTL runs out.
+            if versions != tuple(self._versions.get(table, 0) for table in tables):
+                self._skipped += 1
+                return False
+
+            if key in self._entries:
+                self._remove_locked(key)
+            while len(self._entries) >= self.max_size:
+                self._remove_locked(next(iter(self._entries)))
+                self._evictions += 1
+
+            self._entries[key] = (time.monotonic() + self.ttl, tables, value)
+            for table in tables:
+                self._tagged.setdefault(table, set()).add(key)
+            return True
+
+    def invalidate(self, tables):
+        # Drops every entry read from any of the tables
+        removed = 0
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+                for key in list(self._tagged.get(table, ())):
+                    self._remove_locked(key)
+                    removed += 1
+            self._invalidations += removed
+        return removed
+
+    def clear(self):
+        with self._lock:
+            for table in self._tagged:
+                self._versions[table] = self._versions.get(table, 0) + 1
+            self._entries.clear()
+            self._tagged.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'backend': 'memory',
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / lookups, 4) if lookups else 0.0,
+                'expirations': self._expirations,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+                'skipped_stale': self._skipped,
+            }
+
+    def _remove_locked(self, key):
+        _, tables, _ = self._entries.pop(key)
+        for table in tables:
+            keys = self._tagged.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[table]
+
+
+class SharedCache(ABC):
+    """Query cache kept in a store shared by every worker process, invalidated through per-table versions.
+
+    Each entry is a JSON record of the versions of the tables it was read from at the time the query started, and
+    invalidating a table just increments its version in the store. A lookup compares the recorded versions
+    with the current ones, so an invalidation by any process is seen by all of them on their next lookup.
+    An invalidation that fails is retried before anything else, and the process bypasses the cache until it succeeds.
+    Subclasses implement the storage: _load, _store, _current_versions and _bump.
+    """
+
+    backend = None
+    errors = ()
+
+    # Bumped by clear(), and part of every entry's versions
+    ALL = "*"
+
+    def __init__(self, max_size=1000, ttl=30.0):
+        if max_size < 1 or ttl <= 0:
+            raise ValueError("Cache size and TTL must be positive.")
+
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._stale = 0
+        self._invalidations = 0
+        self._errors = 0
+
+        # Tables whose invalidation could not be written to the store, counted per failed call
+        self._pending = Counter()
+
+    def get(self, key):
+        if not self._flush_pending():
+            self._count("_misses")
+            return False, None
+        try:
+            record = self._load(self._digest(key))
+            if record is not None:
+                tables, versions, value = loads(record)
+                if self._current_versions(tuple(tables)) == tuple(versions):
+                    self._count("_hits")
+                    return True, value
+                self._count("_stale")
+        # A record that doesn't decode is treated like an unreachable store
+        except (ValueError, TypeError, *self.errors) as e:
+            self._failed("reading from", e)
+
+        self._count("_misses")
+        return False, None
+
+    def versions(self, tables):
+        if not self._flush_pending():
+            return None
+        try:
+            return self._current_versions(tuple(tables))
+        except self.errors as e:
+            self._failed("reading from", e)
+            return None
+
+    def set(self, key, tables, value, versions):
+        # versions are the ones from before the query ran: if a table was invalidated in the meantime,
+        # the entry is outdated from the start and no lookup will ever return it
+        if versions is None or not self._flush_pending():
+            return False
+        try:
+            self._store(self._digest(key), dumps([list(tables), list(versions), value]))
+            return True
+        except (TypeError, *self.errors) as e:
+            self._failed("writing to", e)
+            return False
+
+    def invalidate(self, tables):
+        # Returns 0 when the store could not be reached. The tables then stay pending and are retried first thing
+        # on every later call, and until that succeeds this process neither reads nor fills the cache.
+        tables = list(tables)
+        with self._lock:
+            self._pending.update(tables)
+        return len(tables) if self._flush_pending() else 0
+
+    def clear(self):
+        self.invalidate([self.ALL])
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'backend': self.backend,
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / lookups, 4) if lookups else 0.0,
+                'stale': self._stale,
+                'invalidations': self._invalidations,
+                'pending_invalidations': sorted(self._pending),
+                'errors': self._errors,
+            }
+
+    @abstractmethod
+    def _current_versions(self, tables):
+        # Versions of ALL and then each of the tables, 0 for a table never bumped
+        raise NotImplementedError
+
+    @abstractmethod
+    def _load(self, key):
+        # The record stored under key, or None if there is none or it expired
+        raise NotImplementedError
+
+    @abstractmethod
+    def _store(self, key, record):
+        # Stores the record under key until the TTL runs out
+        raise NotImplementedError
+
+    @abstractmethod
+    def _bump(self, tables):
+        # Increments the version of each table
+        raise NotImplementedError
+
+    def _flush_pending(self):
+        with self._lock:
+            pending = self._pending.copy()
+        if not pending:
+            return True
+        try:
+            self._bump(list(pending))
+        except self.errors as e:
+            self._failed("invalidating", e)
+            return False
+        # Only what was bumped is removed: a table invalidated again meanwhile stays pending for that call
+        with self._lock:
+            self._pending -= pending
+            self._invalidations += len(pending)
+        return True
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def _failed(self, action, error):
+        # An unreachable cache only costs hits; queries still go to the database
+        self._count("_errors")
+        print(f"Error {action} query cache:\n{error}")
+
+
+class SQLiteCache(SharedCache):
+    """Shared query cache in an SQLite file, for running several workers on a single host."""
+
+    backend = "sqlite"
+    errors = (sqlite3.Error,)
+
+    def __init__(self, path, max_size=1000, ttl=30.0):
+        super().__init__(max_size, ttl)
+        self.path = path
+
+        # One connection per process, serialized by a lock; WAL lets the other processes read meanwhile
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        # Opened on first use in each process: a connection inherited across fork() must not be used
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    record BLOB NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_expires_at_idx ON entries (expires_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS versions (tag TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _current_versions(self, tables):
+        tags = (self.ALL, *tables)
+        with self._db_lock:
+            rows = self.conn.execute(
+                f"SELECT tag, version FROM versions WHERE tag IN ({', '.join('?' * len(tags))})", tags
+            ).fetchall()
+        current = dict(rows)
+        return tuple(current.get(tag, 0) for tag in tags)
+
+    def _load(self, key):
+        with self._db_lock:
+            row = self.conn.execute(
+                "SELECT record FROM entries WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def _store(self, key, record):
+        now = time.time()
+        with self._db_lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("INSERT OR REPLACE INTO entries (key, record, expires_at) VALUES (?, ?, ?)",
+                                   (key, record, now + self.ttl))
+                # With one TTL for every entry, the entries expiring first are also the oldest ones
+                conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+                conn.execute("""
+                    DELETE FROM entries
+                    WHERE key IN (SELECT key FROM entries ORDER BY expires_at DESC LIMIT -1 OFFSET ?)
+                """, (self.max_size,))
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _bump(self, tables):
+        with self._db_lock:
+            self.conn.executemany("""
+                INSERT INTO versions (tag, version) VALUES (?, 1)
+                ON CONFLICT (tag) DO UPDATE SET version = version + 1
+            """, [(table,) for table in tables])
+
+
+class RedisCache(SharedCache):
+    """Shared query cache on a Redis (or Redis protocol compatible) server.
+
+    Entries expire on the server after the TTL. There is no entry count limit on the client side:
+    give the server a maxmemory with an LRU eviction policy to bound the cache's size.
+    """
+
+    backend = "redis"
+
+    def __init__(self, url, max_size=1000, ttl=30.0, prefix="fightclub:cache:"):
+        if redis is None:
+            raise ImportError("The redis package is required for a redis:// cache backend: pip install redis")
+        super().__init__(max_size, ttl)
+        self.errors = (redis.RedisError,)
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url, socket_timeout=1)
+
+    def _current_versions(self, tables):
+        versions = self.client.mget([f"{self.prefix}version:{tag}" for tag in (self.ALL, *tables)])
+        return tuple(int(version or 0) for version in versions)
+
+    def _load(self, key):
+        return self.client.get(f"{self.prefix}entry:{key}")
+
+    def _store(self, key, record):
+        self.client.set(f"{self.prefix}entry:{key}", record, px=int(self.ttl * 1000))
+
+    def _bump(self, tables):
+        pipeline = self.client.pipeline(transaction=False)
+        for table in tables:
+            pipeline.incr(f"{self.prefix}version:{table}")
+        pipeline.execute()
+
+
+def create_cache(url="memory://", max_size=1000, ttl=30.0):
+    # memory:// keeps results in this process; sqlite:///path/to/file and redis://host:port/db share them
+    if url in ("", "memory", "memory://"):
+        return QueryCache(max_size, ttl)
+    if url.startswith("sqlite://"):
+        return SQLiteCache(url[len("sqlite://"):], max_size, ttl)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCache(url, max_size, ttl)
+    raise ValueError(f"Unsupported cache backend: {url}")
@@ -296,6 +296,82 @@ async function fetchStats() {
     }
 }
 
+// Picker lookups: names starting with prefix, best used through a debounced input handler.
+// withoutGym only returns fighters or trainers that have no gym yet.
+async function fetchAutocomplete(entity, prefix = '', limit = 20, withoutGym = false) {
+    const filter = withoutGym ? '&without_gym=1' : '';
+    const response = await fetch(`/api/autocomplete/${entity}?prefix=${encodeURIComponent(prefix)}&limit=${limit}${filter}`);
+    if (!response.ok) {
+        throw new Error(`Failed to load ${entity}`);
+    }
+    return response.json();
+}
+
+// Delay calls until the input has been quiet for a moment
+function debounce(fn, delay = 250) {
+    let timer = null;
+    return (...args) => {
+        clearTimeout(timer);
+        timer = setTimeout(() => fn(...args), delay);
+    };
+}
+
+// URL of a cursor-paginated API list. What's typed in the search box is searched for by the server,
+// across the whole table rather than just the rows loaded so far.
+function listUrl(path, searchInputId, cursor = null, params = {}) {
+    const query = new URLSearchParams(params);
+    const term = document.getElementById(searchInputId).value.trim();
+    if (term) query.set('search', term);
+    if (cursor) query.set('cursor', cursor);
+    const queryString = query.toString();
+    return queryString ? `${path}?${queryString}` : path;
+}
+
+// Load the first count rows of a cursor-paginated API list again, a page (at most 500 rows) at a time.
+// Resolves to the rows and the cursor to load more from, or null if a page failed to load.
+async function fetchPages(url, count, pageSize = 500) {
+    const separator = url.includes('?') ? '&' : '?';
+    let rows = [];
+    let cursor = null;
+    do {
+        const limit = Math.min(Math.max(count - rows.length, 100), pageSize);
+        const cursorParam = cursor ? '&cursor=' + encodeURIComponent(cursor) : '';
+        const response = await fetch(`${url}${separator}limit=${limit}${cursorParam}`);
+        if (!response.ok) return null;
+        rows = rows.concat(await response.json());
+        cursor = response.headers.get('X-Next-Cursor');
+    } while (cursor && rows.length < count);
+    return { rows, cursor };
+}
+
+// Call onChange whenever a write to any of the tables is committed, by anyone, through /api/events.
+// Bursts of changes arrive as one call. A server with no room for another stream answers 503, which browsers
+// don't retry on their own: the page tries again after retryDelay and reloads what it may have missed.
+function subscribeToChanges(tables, onChange, delay = 500, retryDelay = 60000) {
+    if (!window.EventSource) return;
+
+    const notify = debounce(onChange, delay);
+    const connect = (missed) => {
+        const source = new EventSource('/api/events');
+        source.addEventListener('open', () => {
+            if (missed) notify(tables);
+            missed = false;
+        });
+        source.addEventListener('change', event => {
+            const changed = JSON.parse(event.data).tables;
+            if (changed.some(table => tables.includes(table))) {
+                notify(changed);
+            }
+        });
+        source.addEventListener('error', () => {
+            if (source.readyState === EventSource.CLOSED) {
+                setTimeout(() => connect(true), retryDelay);
+            }
+        });
+    };
+    connect(false);
+}
+
 // Update stats on page load
 window.addEventListener('load', async () => {
     const stats = await fetchStats();
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The application modules are flat files next to this directory, imported by name like app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,107 @@
+import datetime
+import os
+
+import psycopg2
+import pytest
+from dotenv import load_dotenv
+from psycopg2.extensions import make_dsn
+
+load_dotenv()
+
+# database.py connects on import, so it is only imported once there is a database to connect to
+pytestmark = pytest.mark.skipif(not os.environ.get("DB_URI"), reason="needs a PostgreSQL database in DB_URI")
+
+SCHEMAS = ["dbtool_test_source", "dbtool_test_target"]
+
+
+def drop_schemas():
+    conn = psycopg2.connect(os.environ["DB_URI"])
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        for schema in SCHEMAS:
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    conn.close()
+
+
+def database_in(schema):
+    # Every connection of the Database works in its own schema, so the tables of DB_URI are never touched
+    from database import Database
+
+    conn = psycopg2.connect(os.environ["DB_URI"])
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA {schema}")
+    conn.close()
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("DB_URI", make_dsn(os.environ["DB_URI"], options=f"-c search_path={schema},public"))
+        db = Database(max_connections=3, cache_size=0)
+    db.init_db()
+    return db
+
+
+@pytest.fixture(scope="module")
+def databases():
+    drop_schemas()
+    source, target = database_in(SCHEMAS[0]), database_in(SCHEMAS[1])
+    yield source, target
+    source.close()
+    target.close()
+    drop_schemas()
+
+
+def fill(db):
+    gym = db.execute("""
+        INSERT INTO gyms (name, location, owner, reputation_score)
+        VALUES ('Paper Street', 'Wilmington, "DE"', 'Tyler, Durden', 90)
+        RETURNING gym_id
+    """, fetchone=True)['gym_id']
+    fighters = db.execute("""
+        INSERT INTO fighters (name, nickname, weight_class, height, age, nationality, gym_id)
+        VALUES ('Robert Paulson', E'Big\\nBob', 'Heavyweight', 190.50, 48, NULL, %s),
+               ('The Narrator', NULL, 'Welterweight', 178.25, 30, 'American', NULL)
+        RETURNING fighter_id
+    """, (gym,), fetch=True)
+    trainer = db.execute("""
+        INSERT INTO trainers (name, specialty, gym_id) VALUES ('Angel Face', 'Boxing', %s) RETURNING trainer_id
+    """, (gym,), fetchone=True)['trainer_id']
+    db.execute("""
+        INSERT INTO fighter_trainer (fighter_id, trainer_id, start_date, end_date) VALUES (%s, %s, %s, %s)
+    """, (fighters[0]['fighter_id'], trainer, datetime.date(1999, 1, 1), datetime.date(1999, 10, 15)))
+    db.create_match(datetime.datetime(1999, 10, 15, 21, 0), 'Basement', fighters[0]['fighter_id'],
+                    fighters[1]['fighter_id'], datetime.datetime(1999, 10, 15, 21, 4, 30), fighters[1]['fighter_id'])
+
+
+def table_rows(db, table):
+    import dbtool
+
+    conn = db.pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            columns = dbtool.table_columns(cur, table)
+            cur.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {', '.join(columns)}")
+            return [dict(row) for row in cur.fetchall()]
+    finally:
+        db.pool.putconn(conn)
+
+
+@pytest.mark.parametrize("file_format", ["csv", "ndjson"])
+def test_export_import_round_trip(databases, tmp_path, file_format):
+    import dbtool
+
+    source, target = databases
+    if not table_rows(source, "gyms"):
+        fill(source)
+
+    exported = dbtool.export_tables(source, dbtool.TABLES, str(tmp_path), file_format, jobs=2)
+    imported = dbtool.import_tables(target, dbtool.TABLES, str(tmp_path), file_format, jobs=2, truncate=True)
+
+    assert imported == exported
+    for table in dbtool.TABLES:
+        assert table_rows(target, table) == table_rows(source, table), table
+    # Identity sequences continue after the imported ids
+    gym = target.execute("""
+        INSERT INTO gyms (name, location, owner) VALUES ('Lou''s Tavern', 'Wilmington', 'Lou') RETURNING gym_id
+    """, fetchone=True)['gym_id']
+    assert gym > max(row['gym_id'] for row in table_rows(source, "gyms"))
+    target.execute("DELETE FROM gyms WHERE gym_id = %s", (gym,))
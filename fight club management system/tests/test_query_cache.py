@@ -0,0 +1,212 @@
+import datetime
+import time
+from decimal import Decimal
+
+import pytest
+
+import query_cache
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def make_cache(request, tmp_path, monkeypatch):
+    # Returns a factory: every cache it makes shares one store, like the caches of separate worker processes
+    if request.param == "sqlite":
+        path = str(tmp_path / "cache.db")
+        return lambda ttl=30.0: query_cache.SQLiteCache(path, ttl=ttl)
+
+    fakeredis = pytest.importorskip("fakeredis")
+    if query_cache.redis is None:
+        pytest.skip("needs the redis package")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(query_cache.redis.Redis, "from_url",
+                        lambda url, **kwargs: fakeredis.FakeRedis(server=server))
+    return lambda ttl=30.0: query_cache.RedisCache("redis://localhost:6379/0", ttl=ttl)
+
+
+def fill(cache, key, tables, value):
+    # The way Database.execute fills the cache: versions read before the query, stored after it
+    assert cache.set(key, tables, value, cache.versions(tables))
+
+
+def test_hit(make_cache):
+    cache = make_cache()
+    rows = [{'id': 1, 'name': 'Alpha'}]
+    fill(cache, ("SELECT", "()", False), ["gyms"], rows)
+
+    assert cache.get(("SELECT", "()", False)) == (True, rows)
+    assert cache.get(("SELECT", "(1,)", False)) == (False, None)
+    assert cache.stats()['hits'] == 1
+
+
+def test_hit_from_another_instance(make_cache):
+    writer, reader = make_cache(), make_cache()
+    fill(writer, ("q",), ["gyms"], [1, 2])
+
+    assert reader.get(("q",)) == (True, [1, 2])
+
+
+def test_invalidation_is_seen_by_other_instances(make_cache):
+    first, second = make_cache(), make_cache()
+    fill(first, ("gyms",), ["gyms"], [1])
+    fill(first, ("fighters",), ["fighters"], [2])
+    assert second.get(("gyms",)) == (True, [1])
+
+    assert second.invalidate(["gyms"]) == 1
+
+    assert first.get(("gyms",)) == (False, None)
+    assert first.get(("fighters",)) == (True, [2])
+    assert first.stats()['stale'] == 1
+
+
+def test_clear_drops_every_table(make_cache):
+    first, second = make_cache(), make_cache()
+    fill(first, ("gyms",), ["gyms"], [1])
+
+    second.clear()
+
+    assert first.get(("gyms",)) == (False, None)
+
+
+def test_outdated_fill_is_never_served(make_cache):
+    first, second = make_cache(), make_cache()
+    versions = first.versions(["gyms"])
+    # A write committed while the query ran
+    second.invalidate(["gyms"])
+    first.set(("gyms",), ["gyms"], [1], versions)
+
+    assert second.get(("gyms",)) == (False, None)
+
+
+def test_ttl_expiry(make_cache):
+    cache = make_cache(ttl=0.2)
+    fill(cache, ("q",), ["gyms"], [1])
+    assert cache.get(("q",)) == (True, [1])
+
+    time.sleep(0.3)
+
+    assert cache.get(("q",)) == (False, None)
+
+
+def test_round_trips_column_types(make_cache):
+    cache = make_cache()
+    row = {
+        'fee': Decimal("12.50"),
+        'created_at': datetime.datetime(2024, 5, 1, 18, 30, tzinfo=datetime.timezone.utc),
+        'start_date': datetime.date(2024, 5, 1),
+        'duration': datetime.timedelta(minutes=3, seconds=20),
+        'opens_at': datetime.time(9, 0),
+        'name': "Alpha",
+        'gym_id': None,
+    }
+    fill(cache, ("q",), ["matches"], [row])
+
+    assert cache.get(("q",)) == (True, [row])
+
+
+def test_failed_invalidation_bypasses_the_cache_until_retried(make_cache, monkeypatch):
+    cache, other = make_cache(), make_cache()
+    fill(cache, ("q",), ["gyms"], [1])
+    bump = cache._bump
+
+    def unreachable(tables):
+        raise cache.errors[0]("store unreachable")
+
+    monkeypatch.setattr(cache, "_bump", unreachable)
+    assert cache.invalidate(["gyms"]) == 0
+    assert cache.stats()['pending_invalidations'] == ["gyms"]
+    assert cache.get(("q",)) == (False, None)
+    assert cache.versions(["gyms"]) is None
+
+    monkeypatch.setattr(cache, "_bump", bump)
+    assert cache.get(("q",)) == (False, None)
+    assert cache.stats()['pending_invalidations'] == []
+    assert other.get(("q",)) == (False, None)
+
+
+# QueryCache, the in-process backend, keeps entries per instance
+
+
+def test_memory_hit_and_miss():
+    cache = query_cache.QueryCache()
+    fill(cache, ("q",), ["gyms"], [1])
+
+    assert cache.get(("q",)) == (True, [1])
+    assert cache.get(("other",)) == (False, None)
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 1)
+
+
+def test_memory_evicts_least_recently_used():
+    cache = query_cache.QueryCache(max_size=2)
+    fill(cache, ("a",), ["gyms"], "a")
+    fill(cache, ("b",), ["gyms"], "b")
+    # Reading a makes b the least recently used entry
+    cache.get(("a",))
+    fill(cache, ("c",), ["gyms"], "c")
+
+    assert cache.get(("b",)) == (False, None)
+    assert cache.get(("a",)) == (True, "a")
+    assert cache.get(("c",)) == (True, "c")
+    assert cache.stats()['evictions'] == 1
+
+
+def test_memory_ttl_expiry():
+    cache = query_cache.QueryCache(ttl=0.2)
+    fill(cache, ("q",), ["gyms"], [1])
+    assert cache.get(("q",)) == (True, [1])
+
+    time.sleep(0.3)
+
+    assert cache.get(("q",)) == (False, None)
+    assert cache.stats()['expirations'] == 1
+    assert cache.stats()['size'] == 0
+
+
+def test_memory_invalidation_by_table():
+    cache = query_cache.QueryCache()
+    fill(cache, ("gyms",), ["gyms"], [1])
+    fill(cache, ("members",), ["gyms", "fighters"], [2])
+    fill(cache, ("trainers",), ["trainers"], [3])
+
+    assert cache.invalidate(["fighters"]) == 1
+
+    assert cache.get(("members",)) == (False, None)
+    assert cache.get(("gyms",)) == (True, [1])
+    assert cache.get(("trainers",)) == (True, [3])
+
+
+def test_memory_skips_fill_outdated_by_a_write():
+    cache = query_cache.QueryCache()
+    versions = cache.versions(["gyms", "fighters"])
+    # A write committed while the query ran
+    cache.invalidate(["fighters"])
+
+    assert not cache.set(("q",), ["gyms", "fighters"], [1], versions)
+    assert cache.get(("q",)) == (False, None)
+    assert cache.stats()['skipped_stale'] == 1
+
+
+def test_memory_clear():
+    cache = query_cache.QueryCache()
+    versions = cache.versions(["gyms"])
+    fill(cache, ("q",), ["gyms"], [1])
+
+    cache.clear()
+
+    assert cache.get(("q",)) == (False, None)
+    # Also outdates fills that started before the clear
+    assert not cache.set(("q",), ["gyms"], [1], versions)
+
+
+def test_incomplete_shared_backend_fails_on_creation():
+    class NoBump(query_cache.SharedCache):
+        def _current_versions(self, tables):
+            return (0,) * (len(tables) + 1)
+
+        def _load(self, key):
+            return None
+
+        def _store(self, key, record):
+            pass
+
+    with pytest.raises(TypeError):
+        NoBump()
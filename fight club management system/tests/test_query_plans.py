@@ -0,0 +1,24 @@
+import os
+
+import pytest
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# database.py connects on import, so it is only imported once there is a database to connect to
+pytestmark = pytest.mark.skipif(not os.environ.get("DB_URI"), reason="needs a PostgreSQL database in DB_URI")
+
+
+@pytest.fixture(scope="module")
+def db():
+    from database import Database
+
+    db = Database(max_connections=2, cache_size=0)
+    # Creates the schema and every index in INDEXES, so the plans are checked against what the code declares
+    db.init_db()
+    yield db
+    db.close()
+
+
+def test_hot_queries_use_indexes(db):
+    assert db.find_unindexed_queries() == []